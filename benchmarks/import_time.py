@@ -0,0 +1,55 @@
+"""
+Import time of s3contents measured with `python -X importtime` (Python >= 3.7)
+
+    python benchmarks/import_time.py [statement]
+
+Prints the slowest modules, the total and fails if a module that should only be imported
+on demand (gcsfs for an S3 deployment, IPython, the notebook test suites) was imported.
+"""
+import re
+import subprocess
+import sys
+
+STATEMENT = "import s3contents; s3contents.S3ContentsManager"
+
+FORBIDDEN = ("gcsfs", "IPython", "notebook.services.contents.tests", "nose", "requests")
+
+LINE_RE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def import_times(statement):
+    """`(module, self us, cumulative us, depth)` of every module imported by `statement`"""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", statement],
+                          stderr=subprocess.PIPE, universal_newlines=True)
+    if proc.returncode != 0:
+        sys.stderr.write(proc.stderr)
+        sys.exit(proc.returncode)
+    times = []
+    for line in proc.stderr.splitlines():
+        match = LINE_RE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            times.append((module, int(self_us), int(cumulative_us), len(indent) // 2))
+    return times
+
+
+def main(statement=STATEMENT, top=20):
+    times = import_times(statement)
+    print("Statement: {}".format(statement))
+    print("{:>10} {:>12}  {}".format("self (ms)", "cumul. (ms)", "module"))
+    for module, self_us, cumulative_us, _ in sorted(times, key=lambda t: -t[2])[:top]:
+        print("{:10.1f} {:12.1f}  {}".format(self_us / 1000., cumulative_us / 1000., module))
+    total = sum(t[1] for t in times)
+    print("Total: {:.1f} ms, {} modules".format(total / 1000., len(times)))
+
+    imported = set(t[0] for t in times)
+    forbidden = sorted(m for m in imported
+                       if any(m == f or m.startswith(f + ".") for f in FORBIDDEN))
+    if forbidden:
+        print("Unexpected imports: {}".format(", ".join(forbidden)))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(*sys.argv[1:2]))
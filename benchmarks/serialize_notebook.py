@@ -0,0 +1,72 @@
+"""
+Time of the serialization of notebooks when they are saved
+
+    python benchmarks/serialize_notebook.py [notebook.ipynb ...]
+
+Compares the previous path (`json.dumps` to a str, then encoded to UTF-8) with the serializers of
+`s3contents.serializers`. Without arguments a 50MB notebook with embedded plots is generated.
+"""
+import base64
+import json
+import os
+import sys
+import timeit
+
+from s3contents.serializers import SERIALIZERS
+
+REPEAT = 5
+
+
+def synthetic_notebook(n_cells=200, image_size=180 * 1024):
+    """Notebook with code cells whose outputs are PNG plots and text, like real analysis notebooks"""
+    image = base64.b64encode(os.urandom(image_size)).decode("ascii")
+    cells = []
+    for i in range(n_cells):
+        cells.append({
+            "cell_type": "code",
+            "execution_count": i,
+            "metadata": {},
+            "source": "fig, ax = plt.subplots()\nax.plot(df['x{}'], df['y'])\n".format(i),
+            "outputs": [
+                {"output_type": "stream", "name": "stdout", "text": "Résumé of run {}\n".format(i) * 20},
+                {"output_type": "display_data", "metadata": {},
+                 "data": {"image/png": image, "text/plain": "<Figure size 640x480 with 1 Axes>"}},
+            ],
+        })
+    return {"cells": cells, "metadata": {"kernelspec": {"name": "python3"}}, "nbformat": 4,
+            "nbformat_minor": 2}
+
+
+def previous(nb):
+    return json.dumps(nb).encode("utf-8")
+
+
+def bench(name, func, nb):
+    seconds = min(timeit.repeat(lambda: func(nb), number=1, repeat=REPEAT))
+    size = len(func(nb))
+    print("{:<10} {:8.1f} ms {:8.1f} MB".format(name, seconds * 1000, size / 1024. ** 2))
+
+
+def main(paths):
+    if paths:
+        notebooks = []
+        for path in paths:
+            with open(path, "rb") as f:
+                notebooks.append((path, json.loads(f.read().decode("utf-8"))))
+    else:
+        notebooks = [("synthetic", synthetic_notebook())]
+
+    for name, nb in notebooks:
+        print(name)
+        bench("previous", previous, nb)
+        for serializer_name, cls in sorted(SERIALIZERS.items()):
+            try:
+                serializer = cls()
+            except ImportError:
+                print("{:<10} not installed".format(serializer_name))
+                continue
+            bench(serializer_name, serializer.dumps, nb)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
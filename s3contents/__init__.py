@@ -1,15 +1,40 @@
+import sys
+
 from ._version import get_versions
 __version__ = get_versions()["version"]
 del get_versions
 
-# We need this try/except here for tests to work
-try:
-    # This is needed for notebook 5.0, 5.1, 5.2(maybe)
-    # https://github.com/jupyter/notebook/issues/2798
-    import notebook.transutils
-except:
-    # Will fail in notebook 4.X - its ok
-    pass
-
-from .s3manager import S3ContentsManager
-from .gcsmanager import GCSContentsManager
+# The managers are imported on first access so that importing s3contents stays cheap
+# and e.g. an S3-only deployment never imports gcsfs
+_lazy_imports = {
+    "S3ContentsManager": "s3contents.s3manager",
+    "GCSContentsManager": "s3contents.gcsmanager",
+    # The async contents managers need Python 3 and jupyter_server
+    "AsyncS3ContentsManager": "s3contents.async_s3manager",
+    "AsyncGCSContentsManager": "s3contents.async_gcsmanager",
+}
+
+__all__ = sorted(_lazy_imports)
+
+
+def __getattr__(name):
+    if name in _lazy_imports:
+        import importlib
+        return getattr(importlib.import_module(_lazy_imports[name]), name)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
+
+
+if sys.version_info < (3, 7):
+    # No module __getattr__ (PEP 562) before Python 3.7
+    from .s3manager import S3ContentsManager
+    from .gcsmanager import GCSContentsManager
+
+    try:
+        from .async_s3manager import AsyncS3ContentsManager
+        from .async_gcsmanager import AsyncGCSContentsManager
+    except (ImportError, SyntaxError):
+        pass
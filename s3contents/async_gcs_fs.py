@@ -0,0 +1,158 @@
+"""
+Utilities to make GCS look like a regular file system using the asyncio API of gcsfs
+"""
+import asyncio
+import hashlib
+import os
+
+import gcsfs
+
+from s3contents.async_genericfs import AsyncGenericFS
+from s3contents.compat import FileNotFoundError
+from s3contents.gcs_fs import GCSFS
+from s3contents.genericfs import FileInfo, GenericFS, NoSuchFile, directory, missing, utcnow
+
+
+class AsyncGCSFS(AsyncGenericFS, GCSFS):
+    """GCS file system for the async contents manager.
+
+    Takes the same configuration as `GCSFS` but uses gcsfs in asynchronous mode.
+    """
+
+    def __init__(self, log, **kwargs):
+        # Skip GCSFS.__init__: it runs `init` synchronously
+        GenericFS.__init__(self, **kwargs)
+        self.log = log
+        self.metadata_cache.separator = self.block_cache.separator = self.separator
+
+        token = os.path.expanduser(self.token)
+        self.fs = gcsfs.GCSFileSystem(project=self.project, token=token, asynchronous=True)
+        self._session = None
+        self._session_lock = asyncio.Lock()
+
+    async def session(self):
+        """Open the gcsfs session (and initialize the root directory) on first use"""
+        if self._session is not None:
+            return self._session
+        async with self._session_lock:
+            if self._session is None:
+                # Renamed `_set_session` in later gcsfs releases
+                set_session = getattr(self.fs, "_set_session", None) or self.fs.set_session
+                self._session = await set_session()
+                await self.init()
+        return self._session
+
+    async def init(self):
+        await self.mkdir("")
+
+    #  AsyncGenericFS methods ------------------------------------------------------------------------------------------
+
+    async def ls(self, path="", detail=False):
+        path_ = self.path(path)
+        self.log.debug("S3contents.AsyncGCSFS: Listing directory: `%s`", path_)
+        await self.session()
+        records = await self.fs._ls(path_, detail=True)
+        infos = [self.file_info(record) for record in records]
+        for info in infos:
+            self.metadata_cache.put(self.cache_key(info.path), info)
+        if detail:
+            return infos
+        return [info.path for info in infos]
+
+    async def _stat(self, path):
+        path_ = self.path(path)
+        key = self.cache_key(path)
+        record = await self.object_info_async(path_)
+        if record is not None:
+            return self.object_file_info(key, record)
+        if self.implicit_dirs:
+            is_dir = await self.has_objects(path_)
+        else:
+            is_dir = await self.object_info_async(self.path(path, self.dir_keep_file)) is not None
+        if is_dir:
+            return directory(key)
+        return missing(key)
+
+    async def cp(self, old_path, new_path):
+        old_path_, new_path_ = self.path(old_path), self.path(new_path)
+        self.log.debug("S3contents.AsyncGCSFS: Coping `%s` to `%s`", old_path_, new_path_)
+        info = await self.stat(old_path)
+        if info.type == "directory":
+            sources = await self.fs._find(old_path_)
+            pairs = [(src, new_path_ + src[len(old_path_):]) for src in sources]
+        elif info.type == "file":
+            pairs = [(old_path_, new_path_)]
+        else:
+            pairs = []
+        # At most `copy_workers` copies in flight, as the thread pool of `GCSFS.copy_tree`
+        slots = asyncio.Semaphore(max(self.copy_workers, 1))
+
+        async def copy(src, dst):
+            async with slots:
+                await self.fs._cp_file(src, dst)
+        await asyncio.gather(*[copy(src, dst) for src, dst in pairs])
+        self.invalidate(new_path, recursive=True)
+
+    async def rm(self, path):
+        path_ = self.path(path)
+        self.log.debug("S3contents.AsyncGCSFS: Removing: `%s`", path_)
+        info = await self.stat(path)
+        if info.type == "file":
+            await self.fs._rm_file(path_)
+        elif info.type == "directory":
+            files = await self.fs._find(path_)
+            if files:
+                await self.fs._rm(files)
+        self.invalidate(path, recursive=True)
+
+    async def mkdir(self, path):
+        path_ = self.path(path, self.dir_keep_file)
+        self.log.debug("S3contents.AsyncGCSFS: Making dir (touch): `%s`", path_)
+        await self.session()
+        if not (self.implicit_dirs and await self.has_objects(self.path(path))):
+            await self.fs._pipe_file(path_, b"")
+        self.invalidate(path)
+
+    async def read_bytes(self, path):
+        path_ = self.path(path)
+        await self.session()
+        try:
+            return await self.fs._cat_file(path_)
+        except FileNotFoundError:
+            raise NoSuchFile(path_)
+
+    async def write(self, path, content):
+        path_ = self.path(self.unprefix(path))
+        self.log.debug("S3contents.AsyncGCSFS: Writing file: `%s`", path_)
+        await self.session()
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        await self.fs._pipe_file(path_, content)
+        info = FileInfo(path=self.cache_key(path), type="file", size=len(content), mtime=utcnow(),
+                        etag=None, md5=hashlib.md5(content).hexdigest())
+        self.invalidate(path)
+        self.metadata_cache.put(info.path, info)
+        return info
+
+    #  Utilities -------------------------------------------------------------------------------------------------------
+
+    async def has_objects(self, path_):
+        """Whether there is any object under the directory `path_` (a full path),
+        from a listing of at most one object"""
+        await self.session()
+        bucket, _, key = path_.partition(self.separator)
+        prefix = key + self.separator if key else None
+        listing = await self.fs._call("GET", "b/{}/o/", bucket, json_out=True, prefix=prefix,
+                                      maxResults=1)
+        return bool(listing.get("items"))
+
+    async def object_info_async(self, path_):
+        """GCS object resource of the full path `path_` or None if there is no such object"""
+        await self.session()
+        try:
+            record = await self.fs._info(path_)
+        except FileNotFoundError:
+            return None
+        if record.get("type") == "directory" or record.get("storageClass") == "DIRECTORY":
+            return None
+        return record
@@ -0,0 +1,39 @@
+from traitlets import Unicode
+
+from s3contents.async_gcs_fs import AsyncGCSFS
+from s3contents.async_genericmanager import AsyncGenericContentsManager
+
+
+class AsyncGCSContentsManager(AsyncGenericContentsManager):
+
+    project = Unicode(
+        help="GCP Project", allow_none=True, default_value=None).tag(
+            config=True, env="JPYNB_GCS_PROJECT")
+    token = Unicode(
+        help="Path to the GCP token", allow_none=True, default_value=None).tag(
+            config=True, env="JPYNB_GCS_TOKEN_PATH")
+
+    region_name = Unicode(
+        "us-east-1", help="Region name").tag(
+            config=True, env="JPYNB_GCS_REGION_NAME")
+    bucket = Unicode(
+        "notebooks", help="Bucket name to store notebooks").tag(
+            config=True, env="JPYNB_GCS_BUCKET")
+
+    prefix = Unicode("", help="Prefix path inside the specified bucket").tag(config=True)
+    separator = Unicode("/", help="Path separator").tag(config=True)
+
+    def __init__(self, *args, **kwargs):
+        super(AsyncGCSContentsManager, self).__init__(*args, **kwargs)
+
+        self._fs = AsyncGCSFS(
+            log=self.log,
+            project=self.project,
+            token=self.token,
+            bucket=self.bucket,
+            prefix=self.prefix,
+            separator=self.separator,
+            metadata_cache_ttl=self.metadata_cache_ttl,
+            metadata_cache_size=self.metadata_cache_size,
+            copy_workers=self.copy_workers,
+            implicit_dirs=self.implicit_dirs)
@@ -0,0 +1,69 @@
+"""
+Generic asyncio FileSystem class to be used by the async Content Manager
+"""
+
+from s3contents.genericfs import GenericFS, NoSuchFile
+
+
+class AsyncGenericFS(GenericFS):
+    """Coroutine counterpart of `GenericFS`: every file system method is a coroutine.
+
+    Subclasses reuse the traits and path utilities of their sync counterparts and only
+    replace the I/O.
+    """
+
+    async def init(self):
+        raise NotImplementedError("Should be implemented by the file system abstraction")
+
+    async def ls(self, path="", detail=False):
+        raise NotImplementedError("Should be implemented by the file system abstraction")
+
+    async def stat(self, path):
+        key = self.cache_key(path)
+        info = self.metadata_cache.get(key)
+        if info is None:
+            info = await self._stat(path)
+            self.metadata_cache.put(key, info)
+        return info
+
+    async def _stat(self, path):
+        raise NotImplementedError("Should be implemented by the file system abstraction")
+
+    async def isfile(self, path):
+        return (await self.stat(path)).type == "file"
+
+    async def isdir(self, path):
+        return (await self.stat(path)).type == "directory"
+
+    async def mv(self, old_path, new_path):
+        await self.cp(old_path, new_path)
+        await self.rm(old_path)
+
+    async def cp(self, old_path, new_path):
+        raise NotImplementedError("Should be implemented by the file system abstraction")
+
+    async def rm(self, path):
+        raise NotImplementedError("Should be implemented by the file system abstraction")
+
+    async def mkdir(self, path):
+        raise NotImplementedError("Should be implemented by the file system abstraction")
+
+    async def read(self, path):
+        return (await self.read_bytes(path)).decode("utf-8")
+
+    async def read_bytes(self, path):
+        raise NotImplementedError("Should be implemented by the file system abstraction")
+
+    async def lstat(self, path):
+        info = await self.stat(path)
+        if info.type != "file":
+            raise NoSuchFile(path)
+        ret = {}
+        ret["ST_MTIME"] = info.mtime
+        return ret
+
+    async def write(self, path, content):
+        raise NotImplementedError("Should be implemented by the file system abstraction")
+
+    async def write_bytes(self, path, data):
+        return await self.write(path, data)
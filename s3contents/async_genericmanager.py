@@ -0,0 +1,346 @@
+import asyncio
+import os
+import threading
+
+from jupyter_server.services.contents.filecheckpoints import AsyncGenericFileCheckpoints
+from jupyter_server.services.contents.manager import AsyncContentsManager
+from nbformat import from_dict
+from tornado.web import HTTPError
+from traitlets import Bool, Float, HasTraits, Integer, Unicode
+
+from s3contents.cache import MetadataCache
+from s3contents.genericfs import BatchDeleteError, GenericFSError, NoSuchFile
+from s3contents.genericmanager import (
+    DUMMY_CREATED_DATE,
+    GenericContentsManager,
+    base_directory_model,
+    base_model,
+    content_digest,
+    file_content,
+    load_notebook,
+    model_content_bytes,
+    parse_notebook,)
+from s3contents.serializers import get_serializer
+
+
+class AsyncGenericContentsManager(AsyncContentsManager, HasTraits):
+    """Coroutine counterpart of `GenericContentsManager` for jupyter_server.
+
+    Every method awaits an `AsyncGenericFS` so a slow request to the bucket does not
+    block the other handlers running on the IOLoop.
+    """
+
+    # Local directory of the default file checkpoints, unused by the checkpoints in the bucket
+    root_dir = Unicode("./", config=True)
+
+    metadata_cache_ttl = Float(
+        5.0, help="Seconds to cache the metadata (type, size, mtime) of a path, 0 to disable").tag(
+            config=True)
+    metadata_cache_size = Integer(
+        10000, help="Max number of paths in the metadata cache, 0 to disable").tag(config=True)
+
+    copy_workers = Integer(
+        8, help="Number of concurrent server-side copies when copying or moving a directory").tag(
+            config=True)
+
+    implicit_dirs = Bool(
+        False, help="Treat any non-empty prefix as a directory (e.g. uploaded by aws s3 sync or gsutil) "
+        "and only write the keep file of empty directories").tag(config=True)
+
+    notebook_serializer = Unicode(
+        "auto", help="JSON library to parse and serialize notebooks: json, orjson, ujson or auto "
+                     "(the first installed of orjson, ujson and json)").tag(config=True)
+
+    validation_cache_size = Integer(
+        1024, help="Max number of notebook contents whose validation and trust results are remembered, "
+                   "by digest, so unchanged notebooks are not validated and signed again. 0 to disable").tag(
+            config=True)
+    notebook_validator = Unicode(
+        "", help="JSON schema validator of nbformat, e.g. fastjsonschema (needs nbformat >= 5.1 and "
+                 "fastjsonschema). nbformat has no per-call option: this sets the NBFORMAT_VALIDATOR "
+                 "environment variable of the whole process. Empty to keep the nbformat default").tag(
+            config=True)
+
+    process_pool_size = Integer(
+        0, help="Number of processes to parse and validate large notebooks in, so they do not hold the "
+                "GIL of the server. Validation results are passed back through the validation cache. "
+                "0 keeps every notebook in the server process").tag(config=True)
+    process_pool_threshold = Integer(
+        4 * 1024 * 1024, help="Notebooks of at least this many bytes are parsed and validated in the "
+                              "process pool, smaller ones in the server process").tag(config=True)
+
+    def __init__(self, *args, **kwargs):
+        super(AsyncGenericContentsManager, self).__init__(*args, **kwargs)
+        self._fs = None
+        self.serializer = get_serializer(self.notebook_serializer)
+        self.validation_cache = MetadataCache(ttl=float("inf"), max_entries=self.validation_cache_size)
+        self.trust_cache = MetadataCache(ttl=float("inf"), max_entries=self.validation_cache_size)
+        if self.notebook_validator:
+            # Global: nbformat reads the validator from the environment on every validation
+            os.environ["NBFORMAT_VALIDATOR"] = self.notebook_validator
+        self._process_pool = None
+        self._process_pool_lock = threading.Lock()
+
+    def get_fs(self):
+        return self._fs
+    fs = property(get_fs)
+
+    def _checkpoints_class_default(self):
+        return AsyncGenericFileCheckpoints
+
+    def do_error(self, msg, code=500):
+        raise HTTPError(code, msg)
+
+    def no_such_entity(self, path):
+        self.do_error("No such entity: [{path}]".format(path=path), 404)
+
+    async def already_exists(self, path):
+        thing = "File" if await self.file_exists(path) else "Directory"
+        self.do_error(u"{thing} already exists: [{path}]".format(thing=thing, path=path), 409)
+
+    async def guess_type(self, path, allow_directory=True):
+        """
+        Guess the type of a file.
+        If allow_directory is False, don't consider the possibility that the
+        file is a directory.
+        """
+        if path.endswith(".ipynb"):
+            return "notebook"
+        elif allow_directory and await self.dir_exists(path):
+            return "directory"
+        else:
+            return "file"
+
+    async def file_exists(self, path):
+        # Does a file exist at the given path?
+        self.log.debug("S3contents.AsyncGenericManager.file_exists: ('%s')", path)
+        return await self.fs.isfile(path)
+
+    async def dir_exists(self, path):
+        # Does a directory exist at the given path?
+        self.log.debug("S3contents.AsyncGenericManager.dir_exists: path('%s')", path)
+        return await self.fs.isdir(path)
+
+    async def exists(self, path):
+        return (await self.fs.stat(path.strip('/'))).exists
+
+    async def get(self, path, content=True, type=None, format=None):
+        # Get a file or directory model.
+        self.log.debug("S3contents.AsyncGenericManager.get] path('%s') type(%s) format(%s)", path, type, format)
+        path = path.strip('/')
+
+        if type is None:
+            type = await self.guess_type(path)
+        try:
+            func = {
+                "directory": self._directory_model_from_path,
+                "notebook": self._notebook_model_from_path,
+                "file": self._file_model_from_path,
+            }[type]
+        except KeyError:
+            raise ValueError("Unknown type passed: '{}'".format(type))
+
+        if type == "directory":
+            return await func(path, content=content)
+        return await func(path, content=content, format=format)
+
+    async def _directory_model_from_path(self, path, content=False):
+        self.log.debug("S3contents.AsyncGenericManager._directory_model_from_path: path('%s') type(%s)", path, content)
+        model = base_directory_model(path)
+        if content:
+            # The existence check and the listing are independent requests, overlap them
+            is_dir, dir_content = await asyncio.gather(
+                self.dir_exists(path), self.fs.ls(path=path, detail=True))
+            if not is_dir:
+                self.no_such_entity(path)
+            model["format"] = "json"
+            model["content"] = self._convert_file_records(dir_content)
+        return model
+
+    async def _notebook_model_from_path(self, path, content=False, format=None):
+        model = base_model(path)
+        model["type"] = "notebook"
+        info = await self.fs.stat(path)
+        if info.type == "file":
+            model["last_modified"] = model["created"] = info.mtime
+        else:
+            model["last_modified"] = model["created"] = DUMMY_CREATED_DATE
+        if content:
+            if info.type != "file":
+                self.no_such_entity(path)
+            try:
+                data = await self.fs.read_bytes(path)
+            except NoSuchFile as e:
+                self.no_such_entity(e.path)
+            digest = content_digest(data)
+            if self._use_process_pool(data):
+                validate = self.validation_cache.get(digest) is None
+                nb_content, message = await asyncio.get_event_loop().run_in_executor(
+                    self._get_process_pool(), load_notebook, data, self.serializer.name, validate)
+                if validate:
+                    self.validation_cache.put(digest, (message, ))
+            else:
+                nb_content = parse_notebook(data, self.serializer)
+            self._mark_trusted_cells(nb_content, path, digest)
+            model["format"] = "json"
+            model["content"] = nb_content
+            self._validate_notebook_model(model, digest)
+        return model
+
+    async def _file_model_from_path(self, path, content=False, format=None):
+        model = base_model(path)
+        model["type"] = "file"
+        info = await self.fs.stat(path)
+        if info.type == "file":
+            model["last_modified"] = model["created"] = info.mtime
+        else:
+            model["last_modified"] = model["created"] = DUMMY_CREATED_DATE
+        if content:
+            try:
+                data = await self.fs.read_bytes(path)
+            except NoSuchFile as e:
+                self.no_such_entity(e.path)
+            except GenericFSError as e:
+                self.do_error(str(e), 500)
+            try:
+                model["content"], model["format"], model["mimetype"] = file_content(path, data, format)
+            except UnicodeDecodeError:
+                self.do_error("%s is not UTF-8 encoded" % path, 400)
+        return model
+
+    def _convert_file_records(self, records):
+        """
+        Build the models of the entries of a directory from the `FileInfo` records of a single
+        detailed listing, without any additional request per entry.
+        """
+        ret = []
+        for record in records:
+            path = record.path
+            if os.path.basename(path) == self.fs.dir_keep_file:
+                continue
+            if record.type == "directory":
+                ret.append(self._model_from_info(path, "directory", record))
+            elif record.type == "file":
+                type_ = "notebook" if path.endswith(".ipynb") else "file"
+                ret.append(self._model_from_info(path, type_, record))
+            else:
+                self.do_error("Unknown file type %s for file '%s'" % (record.type, path), 500)
+        return ret
+
+    async def save(self, model, path):
+        """Save a file or directory model to path.
+        """
+        self.log.debug("S3contents.AsyncGenericManager: save %s: '%s'", model, path)
+        path = path.strip("/")
+        if "type" not in model:
+            self.do_error("No model type provided", 400)
+        if "content" not in model and model["type"] != "directory":
+            self.do_error("No file content provided", 400)
+
+        if model["type"] not in ("file", "directory", "notebook"):
+            self.do_error("Unhandled contents type: %s" % model["type"], 400)
+
+        validation_message = None
+        try:
+            if model["type"] == "notebook":
+                info, validation_message = await self._save_notebook(model, path)
+            elif model["type"] == "file":
+                info = await self._save_file(model, path)
+            else:
+                info = await self._save_directory(path)
+        except HTTPError:
+            raise
+        except Exception as e:
+            self.log.error("Error while saving file: %s %s", path, e, exc_info=True)
+            self.do_error("Unexpected error while saving file: %s %s" % (path, e), 500)
+
+        # Build the model from the upload response instead of fetching it again
+        model = self._model_from_info(path, model["type"], info)
+        if validation_message is not None:
+            model["message"] = validation_message
+        return model
+
+    def _model_from_info(self, path, type, info):
+        """Build a model without content from the `FileInfo` of `path`"""
+        if type == "directory":
+            return base_directory_model(path)
+        model = base_model(path)
+        model["type"] = type
+        model["last_modified"] = model["created"] = info.mtime or DUMMY_CREATED_DATE
+        return model
+
+    # Same digest-keyed trust and validation results as the sync manager
+    _mark_trusted_cells = GenericContentsManager._mark_trusted_cells
+    _check_and_sign = GenericContentsManager._check_and_sign
+    _validate_notebook_model = GenericContentsManager._validate_notebook_model
+    _get_process_pool = GenericContentsManager._get_process_pool
+    is_checkpoint_dir = GenericContentsManager.is_checkpoint_dir
+
+    def _use_process_pool(self, data):
+        # Awaited, the workers do not block the event loop
+        return self.process_pool_size > 0 and len(data) >= self.process_pool_threshold
+
+    async def _save_notebook(self, model, path):
+        file_contents = self.serializer.dumps(model["content"])
+        digest = content_digest(file_contents)
+        validation = None
+        if self._use_process_pool(file_contents) and self.validation_cache.get(digest) is None:
+            # Validated in a worker while the notebook is signed and uploaded
+            validation = asyncio.get_event_loop().run_in_executor(
+                self._get_process_pool(), load_notebook, file_contents, self.serializer.name, True)
+        if not self.trust_cache.get(digest):
+            self._check_and_sign(from_dict(model['content']), path, digest)
+        info = await self.fs.write(path, file_contents)
+        if validation is not None:
+            self.validation_cache.put(digest, ((await validation)[1], ))
+        self._validate_notebook_model(model, digest)
+        return info, model.get("message")
+
+    async def trust_notebook(self, path):
+        await super(AsyncGenericContentsManager, self).trust_notebook(path)
+        # Notebooks remembered as not trusted may be signed now
+        self.trust_cache.clear()
+
+    async def _save_file(self, model, path):
+        return await self.fs.write_bytes(path, model_content_bytes(model))
+
+    async def _save_directory(self, path):
+        await self.fs.mkdir(path)
+
+    async def rename_file(self, old_path, new_path):
+        """Rename a file or directory.
+
+        NOTE: This method is unfortunately named on the base class.  It
+        actually moves a file or a directory.
+        """
+        self.log.debug("S3contents.AsyncGenericManager: Init rename of '%s' to '%s'", old_path, new_path)
+        new_info, old_info = await asyncio.gather(self.fs.stat(new_path), self.fs.stat(old_path))
+        if new_info.exists:
+            await self.already_exists(new_path)
+        elif old_info.exists:
+            self.log.debug("S3contents.AsyncGenericManager: Actually renaming '%s' to '%s'", old_path,
+                           new_path)
+            await self.fs.mv(old_path, new_path)
+        else:
+            self.no_such_entity(old_path)
+
+    async def delete_file(self, path):
+        """Delete the file or directory at path.
+        """
+        self.log.debug("S3contents.AsyncGenericManager: delete_file '%s'", path)
+        if (await self.fs.stat(path)).exists:
+            try:
+                await self.fs.rm(path)
+            except BatchDeleteError as e:
+                self.do_error(e.message, 500)
+        else:
+            self.no_such_entity(path)
+
+    async def is_hidden(self, path):
+        """Is path a hidden directory or file?
+
+        Only the checkpoints stored in the bucket (and the files under them) are hidden,
+        with the default local checkpoints nothing is.
+        """
+        self.log.debug("S3contents.AsyncGenericManager: is_hidden '%s'", path)
+        return self.is_checkpoint_dir(path.strip("/").split("/")[0])
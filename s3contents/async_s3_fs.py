@@ -0,0 +1,246 @@
+"""
+Utilities to make S3 look like a regular file system using aiobotocore
+"""
+import asyncio
+import contextlib
+import hashlib
+
+from botocore.exceptions import ClientError
+
+from s3contents.async_genericfs import AsyncGenericFS
+from s3contents.genericfs import BatchDeleteError, FileInfo, GenericFS, NoSuchFile, directory, missing
+from s3contents.s3_fs import (
+    DELETE_BATCH_SIZE, MAX_COPY_OBJECT_SIZE, S3FS, etag_md5, response_mtime)
+
+# Parts of the multipart copy of objects larger than CopyObject allows (at most 5GB each)
+COPY_PART_SIZE = 1024 ** 3
+
+
+class AsyncS3FS(AsyncGenericFS, S3FS):
+    """S3 file system for the async contents manager.
+
+    Takes the same configuration as `S3FS` but talks to S3 with an aiobotocore client,
+    so requests from different handlers overlap instead of blocking the IOLoop.
+    """
+
+    def __init__(self, log, **kwargs):
+        # Skip S3FS.__init__: it creates a blocking s3fs client and runs `init` synchronously
+        GenericFS.__init__(self, **kwargs)
+        self.log = log
+        self.metadata_cache.separator = self.block_cache.separator = self.delimiter
+        self._client = None
+        self._exit_stack = None
+        self._client_lock = asyncio.Lock()
+
+    async def client(self):
+        """The aiobotocore client, created (and the root directory initialized) on first use"""
+        if self._client is not None:
+            return self._client
+        async with self._client_lock:
+            if self._client is None:
+                from aiobotocore.config import AioConfig
+                from aiobotocore.session import get_session
+
+                config_kwargs = {}
+                if self.signature_version:
+                    config_kwargs["signature_version"] = self.signature_version
+                exit_stack = contextlib.AsyncExitStack()
+                client = await exit_stack.enter_async_context(get_session().create_client(
+                    "s3",
+                    aws_access_key_id=self.access_key_id,
+                    aws_secret_access_key=self.secret_access_key,
+                    endpoint_url=self.endpoint_url,
+                    region_name=self.region_name,
+                    config=AioConfig(**config_kwargs)))
+                self._exit_stack, self._client = exit_stack, client
+                await self.init()
+        return self._client
+
+    async def close(self):
+        if self._exit_stack is not None:
+            await self._exit_stack.aclose()
+            self._exit_stack, self._client = None, None
+
+    async def init(self):
+        # Only write the root marker when there is nothing under the prefix yet, as `S3FS.init`
+        if not await self.has_objects(self.dir_key("")):
+            await self.mkdir("")
+
+    #  AsyncGenericFS methods ------------------------------------------------------------------------------------------
+
+    async def ls(self, path="", detail=False):
+        path_ = self.path(path)
+        self.log.debug("S3contents.AsyncS3FS: Listing directory: `%s`", path_)
+        client = await self.client()
+        bucket, prefix = self.split_path(path_ + self.delimiter)
+
+        infos = []
+        paginator = client.get_paginator("list_objects_v2")
+        async for page in paginator.paginate(Bucket=bucket, Prefix=prefix, Delimiter=self.delimiter):
+            for common_prefix in page.get("CommonPrefixes", []):
+                infos.append(directory(self.unprefix_key(common_prefix["Prefix"])))
+            for obj in page.get("Contents", []):
+                if obj["Key"] == prefix:
+                    continue
+                infos.append(FileInfo(path=self.unprefix_key(obj["Key"]), type="file",
+                                      size=obj.get("Size", 0), mtime=obj.get("LastModified"),
+                                      etag=obj.get("ETag"), md5=etag_md5(obj.get("ETag"))))
+        for info in infos:
+            self.metadata_cache.put(self.cache_key(info.path), info)
+        if detail:
+            return infos
+        return [info.path for info in infos]
+
+    async def _stat(self, path):
+        path_ = self.path(path)
+        key = self.cache_key(path)
+        client = await self.client()
+        bucket, obj_key = self.split_path(path_)
+        if obj_key:
+            try:
+                head = await client.head_object(Bucket=bucket, Key=obj_key)
+                return FileInfo(path=key, type="file", size=head.get("ContentLength", 0),
+                                mtime=head["LastModified"], etag=head.get("ETag"),
+                                md5=etag_md5(head.get("ETag")))
+            except ClientError as e:
+                if e.response.get("Error", {}).get("Code") not in ("404", "NoSuchKey", "NotFound"):
+                    raise
+            obj_key += self.delimiter
+
+        if not obj_key or await self.has_objects(obj_key):
+            return directory(key)
+        return missing(key)
+
+    async def cp(self, old_path, new_path):
+        old_path_, new_path_ = self.path(old_path), self.path(new_path)
+        self.log.debug("S3contents.AsyncS3FS: Coping `%s` to `%s`", old_path_, new_path_)
+        client = await self.client()
+        info = await self.stat(old_path)
+        bucket, old_key = self.split_path(old_path_)
+        _, new_key = self.split_path(new_path_)
+
+        if info.type == "directory":
+            objects = await self.list_objects(old_key + self.delimiter)
+            pairs = [(key, new_key + key[len(old_key):], size) for key, size in objects]
+        elif info.type == "file":
+            pairs = [(old_key, new_key, info.size)]
+        else:
+            pairs = []
+        # At most `copy_workers` copies in flight, as the thread pool of `S3FS.copy_tree`
+        slots = asyncio.Semaphore(max(self.copy_workers, 1))
+
+        async def copy(src, dst, size):
+            async with slots:
+                await self.copy_object(client, src, dst, size)
+        await asyncio.gather(*[copy(*pair) for pair in pairs])
+        self.invalidate(new_path, recursive=True)
+
+    async def copy_object(self, client, src_key, dst_key, size=0):
+        copy_source = {"Bucket": self.bucket, "Key": src_key}
+        if size <= MAX_COPY_OBJECT_SIZE:
+            await client.copy_object(Bucket=self.bucket, Key=dst_key, CopySource=copy_source,
+                                     **self.sse_kwargs())
+            return
+        # CopyObject is limited to 5GB: copy the object in parts
+        upload = await client.create_multipart_upload(Bucket=self.bucket, Key=dst_key, **self.sse_kwargs())
+        upload_id = upload["UploadId"]
+        try:
+            parts = []
+            for number, start in enumerate(range(0, size, COPY_PART_SIZE), 1):
+                end = min(start + COPY_PART_SIZE, size) - 1
+                response = await client.upload_part_copy(
+                    Bucket=self.bucket, Key=dst_key, UploadId=upload_id, PartNumber=number,
+                    CopySource=copy_source, CopySourceRange="bytes={}-{}".format(start, end))
+                parts.append({"PartNumber": number, "ETag": response["CopyPartResult"]["ETag"]})
+            await client.complete_multipart_upload(Bucket=self.bucket, Key=dst_key, UploadId=upload_id,
+                                                   MultipartUpload={"Parts": parts})
+        except Exception:
+            await client.abort_multipart_upload(Bucket=self.bucket, Key=dst_key, UploadId=upload_id)
+            raise
+
+    async def rm(self, path):
+        path_ = self.path(path)
+        self.log.debug("S3contents.AsyncS3FS: Removing: `%s`", path_)
+        client = await self.client()
+        info = await self.stat(path)
+        bucket, key = self.split_path(path_)
+        try:
+            if info.type == "file":
+                await client.delete_object(Bucket=bucket, Key=key)
+            elif info.type == "directory":
+                await self.delete_keys([k for k, _ in await self.list_objects(key + self.delimiter)])
+        finally:
+            self.invalidate(path, recursive=True)
+
+    async def delete_keys(self, keys):
+        """Delete objects by key, 1000 keys per DeleteObjects request.
+        Raise `BatchDeleteError` with the keys that could not be deleted.
+        """
+        client = await self.client()
+        errors = {}
+        for i in range(0, len(keys), DELETE_BATCH_SIZE):
+            batch = keys[i:i + DELETE_BATCH_SIZE]
+            response = await client.delete_objects(Bucket=self.bucket, Delete={
+                "Objects": [{"Key": k} for k in batch], "Quiet": True})
+            for error in response.get("Errors", []):
+                errors[error["Key"]] = "{}: {}".format(error.get("Code"), error.get("Message"))
+        if errors:
+            raise BatchDeleteError(errors)
+
+    async def mkdir(self, path):
+        path_ = self.path(path, self.dir_keep_file)
+        self.log.debug("S3contents.AsyncS3FS: Making dir: `%s`", path_)
+        client = await self.client()
+        if not (self.implicit_dirs and await self.has_objects(self.dir_key(path))):
+            bucket, key = self.split_path(path_)
+            await client.put_object(Bucket=bucket, Key=key, Body=b"", **self.sse_kwargs())
+        self.invalidate(path)
+
+    async def read_bytes(self, path):
+        path_ = self.path(path)
+        client = await self.client()
+        bucket, key = self.split_path(path_)
+        try:
+            response = await client.get_object(Bucket=bucket, Key=key)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                raise NoSuchFile(path_)
+            raise
+        async with response["Body"] as stream:
+            return await stream.read()
+
+    async def write(self, path, content):
+        path_ = self.path(self.unprefix(path))
+        self.log.debug("S3contents.AsyncS3FS: Writing file: `%s`", path_)
+        client = await self.client()
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        bucket, key = self.split_path(path_)
+        response = await client.put_object(Bucket=bucket, Key=key, Body=content, **self.sse_kwargs())
+        info = FileInfo(path=self.cache_key(path), type="file", size=len(content),
+                        mtime=response_mtime(response),
+                        etag=response.get("ETag"), md5=hashlib.md5(content).hexdigest())
+        self.invalidate(path)
+        self.metadata_cache.put(info.path, info)
+        return info
+
+    #  Utilities -------------------------------------------------------------------------------------------------------
+
+    async def has_objects(self, prefix):
+        """Whether there is any object under the key `prefix`, from a listing of at most one key"""
+        client = await self.client()
+        listing = await client.list_objects_v2(Bucket=self.bucket, Prefix=prefix, MaxKeys=1)
+        return listing.get("KeyCount", len(listing.get("Contents", []))) > 0
+
+    async def list_objects(self, prefix):
+        """`(key, size)` of every object under `prefix`, recursively, from a single paginated listing"""
+        client = await self.client()
+        objects = []
+        paginator = client.get_paginator("list_objects_v2")
+        async for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            objects.extend((obj["Key"], obj.get("Size", 0)) for obj in page.get("Contents", []))
+        return objects
+
+    def unprefix_key(self, key):
+        """Path of an object key relative to the prefix"""
+        return self.unprefix(self.bucket + self.delimiter + key).strip(self.delimiter)
@@ -0,0 +1,223 @@
+"""
+In-process caches used to avoid repeated round trips to the object store
+"""
+import time
+import threading
+from collections import OrderedDict, namedtuple
+
+
+class MetadataCache(object):
+    """Bounded LRU cache of path metadata with a per-entry TTL.
+
+    Keys are unprefixed paths without leading or trailing separators, values are the
+    `FileInfo` of the path (a `FileInfo` with `type=None` records a missing path).
+    A `ttl` or `max_entries` of 0 disables the cache.
+    """
+
+    def __init__(self, ttl=5.0, max_entries=10000, separator="/", clock=time.time):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.separator = separator
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.max_entries > 0
+
+    def get(self, key):
+        """Return the cached value for `key` or None if it is missing or expired"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires > self.clock():
+                    self._entries.pop(key)
+                    self._entries[key] = entry
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, self.clock() + self.ttl)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key, recursive=False):
+        """Drop `key` and all its ancestors (their existence may have changed).
+        If `recursive` is True also drop every entry under `key`.
+        """
+        with self._lock:
+            parts = key.split(self.separator) if key else []
+            for i in range(len(parts) + 1):
+                self._entries.pop(self.separator.join(parts[:i]), None)
+            if recursive:
+                prefix = key + self.separator if key else ""
+                for k in [k for k in self._entries if k.startswith(prefix)]:
+                    del self._entries[k]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Counters to tune the cache size and TTL"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+
+CacheEntry = namedtuple("CacheEntry", ["etag", "data", "value", "size"])
+
+
+class ContentCache(object):
+    """LRU cache of file contents validated by ETag and bounded by total bytes.
+
+    Each entry keeps the ETag and either the raw bytes or a parsed value (e.g. the notebook),
+    only the value is kept when there is one.
+    Entries larger than `max_bytes` are not cached, a `max_bytes` of 0 disables the cache.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, separator="/"):
+        self.max_bytes = max_bytes
+        self.separator = separator
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the `CacheEntry` of `key` or None. The caller revalidates the ETag"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            self._entries[key] = entry
+            return entry
+
+    def record(self, hit):
+        """Count the result of a revalidation"""
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def put(self, key, etag, data, value=None):
+        """Cache `data` (and its parsed `value`), return whether the entry was stored"""
+        # The parsed value takes about as much memory as the raw data
+        size = len(data) * (2 if value is not None else 1)
+        with self._lock:
+            self._pop(key)
+            if etag is None or size > self.max_bytes:
+                return False
+            if value is not None:
+                data = None
+            self._entries[key] = CacheEntry(etag=etag, data=data, value=value, size=size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.total_bytes -= evicted.size
+                self.evictions += 1
+            return True
+
+    def invalidate(self, key, recursive=False):
+        with self._lock:
+            self._pop(key)
+            if recursive:
+                prefix = key + self.separator if key else ""
+                for k in [k for k in self._entries if k.startswith(prefix)]:
+                    self._pop(k)
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry.size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self.total_bytes,
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class _Call(object):
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight(object):
+    """Coalesce concurrent calls for the same key.
+
+    The first caller runs the function, the callers arriving while it runs wait for it
+    and get the same result (or exception) instead of repeating the work.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args, **kwargs):
+        """Return `(result, shared)`, `shared` is True when the result went to more than one caller"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = func(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result, call.waiters > 0
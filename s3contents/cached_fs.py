@@ -0,0 +1,506 @@
+"""
+Local disk cache in front of a file system of the Content Manager
+"""
+
+import atexit
+import datetime
+import hashlib
+import json
+import os
+import posixpath
+import threading
+import time
+import uuid
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from dateutil.tz import tzutc
+
+from s3contents.genericfs import CHUNK_SIZE, FileInfo, GenericFS, iter_chunks
+from s3contents.ipycompat import Bool, Float, Integer, Unicode
+
+
+# A file on the local disk: `path` as given to `write`, `key` from `cache_key`, `file` the name of the data
+# file and `version` the write it holds. `dirty` entries are not uploaded yet, their meta file is the journal.
+LocalEntry = namedtuple("LocalEntry", ["path", "key", "file", "size", "etag", "md5", "mtime", "dirty", "version"])
+
+# Attributes of the wrapped file system identifying the objects it holds
+LOCATION_FIELDS = ("endpoint_url", "project", "bucket", "prefix")
+# Temporary and unreferenced files older than this are left by a crash, not being written by another server
+STALE_FILE_AGE = 24 * 3600
+
+
+def fsync_dir(path):
+    """Make a rename in the directory `path` durable (no-op where directories cannot be opened)"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class CachedFS(GenericFS):
+    """Wrapper around a `GenericFS` (`S3FS`, `GCSFS`) keeping recently used files on the local disk.
+
+    Reads are served from the disk once the ETag of the object is validated, with the metadata cache
+    of the wrapped file system. With `write_back` a write returns as soon as the file is durably on
+    the local disk and is uploaded in the background: the meta file of a pending upload is its journal,
+    pending uploads are resumed on restart and flushed at exit. Until then the file is served from the
+    local disk. Moves, copies and deletes upload the pending writes they touch first.
+
+    The files are kept in a subdirectory of `cache_dir` for the bucket and prefix of the wrapped file
+    system, so servers of different buckets can share `cache_dir` without replaying each other's journal.
+
+    Clean files are evicted, least recently used first, once the cache is over `cache_size` bytes.
+    """
+
+    cache_dir = Unicode(
+        help="Directory on the local disk (e.g. an SSD) to keep the files in").tag(config=True)
+    cache_size = Integer(
+        1024 * 1024 * 1024, help="Max bytes of files on the local disk, files waiting to be uploaded "
+                                 "are never evicted").tag(config=True)
+    write_back = Bool(
+        True, help="Acknowledge writes once they are on the local disk and upload them in the background, "
+                   "otherwise upload them before returning").tag(config=True)
+    upload_workers = Integer(
+        2, help="Number of files uploaded concurrently in the background").tag(config=True)
+    upload_retry_delay = Float(
+        30.0, help="Seconds to wait before retrying a failed background upload").tag(config=True)
+
+    def __init__(self, fs, log, **kwargs):
+        super(CachedFS, self).__init__(**kwargs)
+        self.base_fs = fs
+        self.log = log
+        # Paths are validated with the metadata of the wrapped file system
+        self.metadata_cache = fs.metadata_cache
+        self.block_cache = fs.block_cache
+
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # key -> lock serializing the local writes, and the uploads, of a path
+        self._write_locks = {}
+        self._upload_locks = {}
+        self._queued = set()
+        self._uploads = ThreadPoolExecutor(max_workers=self.upload_workers)
+
+        self.location = dict(((name, getattr(fs, name, None)) for name in LOCATION_FIELDS), fs=type(fs).__name__)
+        self.local_dir = os.path.join(
+            self.cache_dir, hashlib.sha1(json.dumps(self.location, sort_keys=True).encode("utf-8")).hexdigest())
+        if not os.path.isdir(self.local_dir):
+            os.makedirs(self.local_dir)
+        self._load()
+        atexit.register(self._flush_at_exit)
+
+    def __getattr__(self, name):
+        # Everything else (bucket, split_path, sse_kwargs, fs...) is the one of the wrapped file system
+        if name == "base_fs" or name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(self.base_fs, name)
+
+    #  GenericFS methods -----------------------------------------------------------------------------------------------
+
+    def init(self):
+        self.base_fs.ensure_init()
+
+    def ls(self, path="", detail=False):
+        listing = self.base_fs.ls(path, detail=detail)
+        # Files not uploaded yet
+        parent = self.cache_key(path)
+        listed = set(info.path for info in listing) if detail else set(listing)
+        with self._lock:
+            pending = [entry for entry in self._entries.values()
+                       if entry.dirty and posixpath.dirname(entry.key) == parent and entry.key not in listed]
+        if detail:
+            return listing + [self.file_info(entry) for entry in pending]
+        return listing + [entry.key for entry in pending]
+
+    def stat(self, path):
+        key = self.cache_key(path)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry.dirty:
+            return self.file_info(entry)
+        return self.base_fs.stat(path)
+
+    def head(self, path):
+        key = self.cache_key(path)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry.dirty:
+            return self.file_info(entry)
+        return self.base_fs.head(path)
+
+    def mv(self, old_path, new_path):
+        self.flush(old_path)
+        self.flush(new_path)
+        self.base_fs.mv(old_path, new_path)
+        self.discard(old_path)
+        self.discard(new_path)
+
+    def cp(self, old_path, new_path):
+        self.flush(old_path)
+        self.flush(new_path)
+        self.base_fs.cp(old_path, new_path)
+        self.discard(new_path)
+
+    def rm(self, path):
+        self.flush(path)
+        self.base_fs.rm(path)
+        self.discard(path)
+
+    def mkdir(self, path):
+        self.base_fs.mkdir(path)
+
+    def read_if_changed(self, path, etag=None):
+        entry = self.local_entry(path)
+        if entry is not None:
+            if etag is not None and etag == entry.etag:
+                return None, etag
+            try:
+                with open(self._file_path(entry.file), "rb") as f:
+                    return f.read(), entry.etag
+            except (IOError, OSError):
+                # Evicted meanwhile
+                pass
+        data, new_etag = self.base_fs.read_if_changed(path, etag)
+        if data is not None:
+            self._store(path, data, new_etag)
+        return data, new_etag
+
+    def read_range(self, path, offset, length):
+        entry = self.local_entry(path)
+        if entry is not None:
+            try:
+                with open(self._file_path(entry.file), "rb") as f:
+                    f.seek(offset)
+                    return f.read(max(length, 0))
+            except (IOError, OSError):
+                pass
+        return self.base_fs.read_range(path, offset, length)
+
+    def write(self, path, content):
+        key = self.cache_key(path)
+        version = uuid.uuid4().hex
+        name = "{}.{}".format(self._name(key), version)
+        size, md5 = self._write_file(name, content, durable=self.write_back)
+        entry = LocalEntry(path=path, key=key, file=name, size=size, etag='"{}"'.format(md5), md5=md5,
+                           mtime=time.time(), dirty=self.write_back, version=version)
+        if not self.write_back:
+            with open(self._file_path(name), "rb") as f:
+                info = self.base_fs.write_bytes(path, self._file_content(f, size))
+            entry = entry._replace(etag=info.etag, mtime=_timestamp(info.mtime))
+            self._put(entry)
+        else:
+            self.log.debug("S3contents.CachedFS: Wrote `%s` to the local disk", path)
+            self._put(entry)
+            # The object in the bucket is stale until the upload
+            self.base_fs.invalidate(path)
+            self._schedule(key)
+        self._evict()
+        return self.file_info(entry)
+
+    def open_writer(self, path):
+        self.flush(path)
+        return self.base_fs.open_writer(path)
+
+    def close_writer(self, path, writer):
+        info = self.base_fs.close_writer(path, writer)
+        self.discard(path)
+        return info
+
+    def presigned_url(self, path, expires_in, download=False):
+        self.flush(path)
+        return self.base_fs.presigned_url(path, expires_in, download=download)
+
+    def cache_key(self, path):
+        return self.base_fs.cache_key(path)
+
+    def invalidate(self, path, recursive=False):
+        # Local files are validated by ETag, only the metadata needs to be fetched again
+        self.base_fs.invalidate(path, recursive=recursive)
+
+    def flush(self, path=None):
+        """Upload the pending writes of `path` and of everything under it (all of them if `path` is None)
+        and wait for the uploads. Errors of the uploads are raised."""
+        prefix = None if path is None else self.cache_key(path)
+        with self._lock:
+            keys = [key for key, entry in self._entries.items()
+                    if entry.dirty and (not prefix or key == prefix or key.startswith(prefix + "/"))]
+        for key in keys:
+            self._upload(key)
+
+    #  Local cache -----------------------------------------------------------------------------------------------------
+
+    def local_entry(self, path):
+        """`LocalEntry` of `path` if its content on the local disk is current, None otherwise.
+        Clean files are validated with the ETag of the object in the wrapped file system."""
+        key = self.cache_key(path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            # Most recently used last
+            self._entries[key] = self._entries.pop(key)
+        if entry.dirty:
+            return entry
+        info = self.base_fs.stat(path)
+        if info.type == "file" and info.etag == entry.etag:
+            return entry
+        self.log.debug("S3contents.CachedFS: `%s` changed in the bucket", path)
+        self._drop(entry)
+        return None
+
+    def discard(self, path):
+        """Drop the clean local files of `path` and of everything under it"""
+        prefix = self.cache_key(path)
+        with self._lock:
+            entries = [entry for key, entry in self._entries.items()
+                       if not entry.dirty and (not prefix or key == prefix or key.startswith(prefix + "/"))]
+        for entry in entries:
+            self._drop(entry)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "dirty": sum(1 for entry in self._entries.values() if entry.dirty),
+                "bytes": self.total_bytes,
+            }
+
+    def file_info(self, entry):
+        mtime = datetime.datetime.utcfromtimestamp(entry.mtime).replace(tzinfo=tzutc())
+        return FileInfo(path=entry.key, type="file", size=entry.size, mtime=mtime, etag=entry.etag,
+                        md5=entry.md5)
+
+    def _name(self, key):
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def _file_path(self, name):
+        return os.path.join(self.local_dir, name)
+
+    def _file_content(self, f, size):
+        """Content of the open local file `f` to upload: its bytes, or an iterable of chunks if it is large"""
+        if size <= CHUNK_SIZE:
+            return f.read()
+        return iter(lambda: f.read(CHUNK_SIZE), b"")
+
+    def _write_file(self, name, content, durable):
+        """Write `content` to the data file `name`, through a temporary file so a crash never leaves a
+        partial file. Return the size and the hex MD5 of the bytes written."""
+        tmp = self._file_path("{}.{}.tmp".format(name, uuid.uuid4().hex))
+        md5, size = hashlib.md5(), 0
+        try:
+            with open(tmp, "wb") as f:
+                for chunk in iter_chunks(content):
+                    f.write(chunk)
+                    md5.update(chunk)
+                    size += len(chunk)
+                if durable:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.rename(tmp, self._file_path(name))
+        except Exception:
+            _remove(tmp)
+            raise
+        return size, md5.hexdigest()
+
+    def _write_meta(self, entry):
+        """Replace the meta file of `entry`, durably if it is a pending upload"""
+        meta = self._file_path(self._name(entry.key) + ".json")
+        tmp = "{}.{}.tmp".format(meta, uuid.uuid4().hex)
+        with open(tmp, "w") as f:
+            json.dump(dict(entry._asdict(), location=self.location), f)
+            if entry.dirty:
+                f.flush()
+                os.fsync(f.fileno())
+        os.rename(tmp, meta)
+        if entry.dirty:
+            fsync_dir(self.local_dir)
+
+    def _store(self, path, data, etag):
+        """Keep the bytes of `path` just downloaded, unless they are larger than the whole cache"""
+        if etag is None or len(data) > self.cache_size:
+            return
+        key = self.cache_key(path)
+        version = uuid.uuid4().hex
+        name = "{}.{}".format(self._name(key), version)
+        size, md5 = self._write_file(name, data, durable=False)
+        entry = LocalEntry(path=path, key=key, file=name, size=size, etag=etag, md5=md5, mtime=time.time(),
+                           dirty=False, version=version)
+        if not self._put(entry, replace_dirty=False):
+            # Written locally meanwhile
+            _remove(self._file_path(name))
+            return
+        self._evict()
+
+    def _put(self, entry, replace_dirty=True):
+        """Add or replace the entry of `entry.key`. Return False, and keep the current entry, if it is a
+        pending upload and `replace_dirty` is False."""
+        with self._key_lock(self._write_locks, entry.key):
+            with self._lock:
+                old = self._entries.get(entry.key)
+            if old is not None and old.dirty and not replace_dirty:
+                return False
+            self._write_meta(entry)
+            with self._lock:
+                self._entries.pop(entry.key, None)
+                self._entries[entry.key] = entry
+                self.total_bytes += entry.size - (old.size if old else 0)
+        if old is not None and old.file != entry.file:
+            _remove(self._file_path(old.file))
+        return True
+
+    def _drop(self, entry):
+        """Remove `entry` from the disk, unless it was replaced meanwhile"""
+        with self._key_lock(self._write_locks, entry.key):
+            with self._lock:
+                current = self._entries.get(entry.key)
+                if current is None or current.version != entry.version:
+                    return
+                del self._entries[entry.key]
+                self.total_bytes -= entry.size
+            _remove(self._file_path(self._name(entry.key) + ".json"))
+        _remove(self._file_path(entry.file))
+
+    def _evict(self):
+        """Drop the least recently used clean files until the cache fits in `cache_size`"""
+        evicted = []
+        with self._lock:
+            total = self.total_bytes
+            for entry in self._entries.values():
+                if total <= self.cache_size:
+                    break
+                if not entry.dirty:
+                    evicted.append(entry)
+                    total -= entry.size
+        for entry in evicted:
+            self.log.debug("S3contents.CachedFS: Evicting `%s`", entry.path)
+            self._drop(entry)
+
+    def _load(self):
+        """Rebuild the cache from the meta files and resume the uploads of the journal"""
+        names = os.listdir(self.local_dir)
+        entries = []
+        # Data files of the meta files of another location, left alone
+        files = set()
+        for name in names:
+            path = self._file_path(name)
+            if name.endswith(".tmp"):
+                if _is_stale(path):
+                    _remove(path)
+            elif name.endswith(".json"):
+                try:
+                    with open(path) as f:
+                        meta = json.load(f)
+                    if meta.pop("location", None) != self.location:
+                        files.add(meta.get("file"))
+                        self.log.warning("S3contents.CachedFS: Skipping `%s` of another bucket or prefix", name)
+                        continue
+                    entry = LocalEntry(**meta)
+                    if os.path.getsize(self._file_path(entry.file)) != entry.size:
+                        raise ValueError("Size of {} does not match".format(entry.file))
+                except (IOError, OSError, TypeError, ValueError) as e:
+                    self.log.warning("S3contents.CachedFS: Ignoring `%s`: %s", name, e)
+                    _remove(path)
+                    continue
+                entries.append(entry)
+        # Least recently used first
+        entries.sort(key=lambda entry: os.path.getatime(self._file_path(entry.file)))
+        for entry in entries:
+            self._entries[entry.key] = entry
+            self.total_bytes += entry.size
+        files.update(entry.file for entry in entries)
+        for name in names:
+            if not name.endswith((".tmp", ".json")) and name not in files and _is_stale(self._file_path(name)):
+                _remove(self._file_path(name))
+        dirty = [entry.key for entry in entries if entry.dirty]
+        if dirty:
+            self.log.info("S3contents.CachedFS: Resuming %s uploads from `%s`", len(dirty), self.local_dir)
+        for key in dirty:
+            self._schedule(key)
+
+    #  Background uploads ----------------------------------------------------------------------------------------------
+
+    def _key_lock(self, locks, key):
+        with self._lock:
+            lock = locks.get(key)
+            if lock is None:
+                lock = locks[key] = threading.Lock()
+            return lock
+
+    def _schedule(self, key):
+        """Upload `key` in the background, once even if it is written several times meanwhile"""
+        with self._lock:
+            if key in self._queued:
+                return
+            self._queued.add(key)
+        self._uploads.submit(self._background_upload, key)
+
+    def _background_upload(self, key):
+        with self._lock:
+            self._queued.discard(key)
+        try:
+            self._upload(key)
+        except Exception:
+            self.log.exception("S3contents.CachedFS: Upload of `%s` failed, retrying in %s seconds", key,
+                               self.upload_retry_delay)
+            timer = threading.Timer(self.upload_retry_delay, self._schedule, [key])
+            timer.daemon = True
+            timer.start()
+
+    def _upload(self, key):
+        """Upload the pending write of `key`, if any. Uploads of a path run one at a time, so the last
+        write is the last one uploaded."""
+        with self._key_lock(self._upload_locks, key):
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry is None or not entry.dirty:
+                return
+            self.log.debug("S3contents.CachedFS: Uploading `%s`", entry.path)
+            with open(self._file_path(entry.file), "rb") as f:
+                info = self.base_fs.write_bytes(entry.path, self._file_content(f, entry.size))
+            with self._key_lock(self._write_locks, key):
+                with self._lock:
+                    current = self._entries.get(key)
+                if current is None or current.version != entry.version:
+                    # Written again meanwhile, that write has its own upload
+                    return
+                entry = entry._replace(dirty=False, etag=info.etag)
+                self._write_meta(entry)
+                with self._lock:
+                    self._entries[key] = entry
+        self._evict()
+
+    def _flush_at_exit(self):
+        try:
+            self.flush()
+        except Exception:
+            self.log.exception("S3contents.CachedFS: Could not upload every pending write, they are "
+                               "uploaded on the next start from `%s`", self.local_dir)
+        self._uploads.shutdown(wait=True)
+
+
+def _timestamp(mtime):
+    if mtime is None:
+        return time.time()
+    return (mtime - datetime.datetime(1970, 1, 1, tzinfo=tzutc())).total_seconds()
+
+
+def _is_stale(path):
+    try:
+        return time.time() - os.path.getmtime(path) > STALE_FILE_AGE
+    except OSError:
+        return False
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
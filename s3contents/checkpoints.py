@@ -0,0 +1,239 @@
+"""
+Checkpoints stored in the bucket next to the notebooks
+"""
+import posixpath
+
+from tornado.web import HTTPError
+
+from botocore.exceptions import ClientError
+
+from s3contents.ipycompat import Checkpoints, GenericFileCheckpoints, Integer, Unicode
+
+
+class GenericCheckpoints(Checkpoints):
+    """Checkpoints stored under `checkpoint_dir` in the file system of the contents manager.
+
+    Creating and restoring a checkpoint is a server-side copy in the bucket,
+    the content never goes through the notebook server.
+    Like the local file checkpoints there is a single checkpoint per file.
+    """
+
+    checkpoint_dir = Unicode(
+        ".checkpoints", help="Directory (relative to the prefix) to store the checkpoints in").tag(
+            config=True)
+
+    checkpoint_id = u"checkpoint"
+
+    def get_fs(self):
+        return self.parent.fs
+    fs = property(get_fs)
+
+    def checkpoint_path(self, checkpoint_id, path):
+        """Path of a checkpoint: `<checkpoint_dir>/<parent dir>/<name>-<checkpoint id><ext>`"""
+        path = path.strip("/")
+        parent, name = posixpath.split(path)
+        basename, ext = posixpath.splitext(name)
+        filename = u"{name}-{checkpoint_id}{ext}".format(
+            name=basename, checkpoint_id=checkpoint_id, ext=ext)
+        return posixpath.join(self.checkpoint_dir.strip("/"), parent, filename)
+
+    def checkpoint_model(self, checkpoint_id, info):
+        return {"id": checkpoint_id, "last_modified": info.mtime}
+
+    def no_such_checkpoint(self, path, checkpoint_id):
+        raise HTTPError(404, u"Checkpoint does not exist: {path}@{checkpoint_id}".format(
+            path=path, checkpoint_id=checkpoint_id))
+
+    def create_checkpoint(self, contents_mgr, path):
+        checkpoint_id = self.checkpoint_id
+        cp_path = self.checkpoint_path(checkpoint_id, path)
+        self.log.debug("S3contents.Checkpoints: Creating checkpoint `%s` of `%s`", cp_path, path)
+        self.fs.cp(path, cp_path)
+        return self.checkpoint_model(checkpoint_id, self.fs.stat(cp_path))
+
+    def restore_checkpoint(self, contents_mgr, checkpoint_id, path):
+        cp_path = self.checkpoint_path(checkpoint_id, path)
+        self.log.debug("S3contents.Checkpoints: Restoring `%s` from `%s`", path, cp_path)
+        if not self.fs.isfile(cp_path):
+            self.no_such_checkpoint(path, checkpoint_id)
+        self.fs.cp(cp_path, path)
+
+    def rename_checkpoint(self, checkpoint_id, old_path, new_path):
+        old_cp_path = self.checkpoint_path(checkpoint_id, old_path)
+        new_cp_path = self.checkpoint_path(checkpoint_id, new_path)
+        if self.fs.isfile(old_cp_path):
+            self.log.debug("S3contents.Checkpoints: Renaming checkpoint `%s` to `%s`", old_cp_path,
+                           new_cp_path)
+            self.fs.mv(old_cp_path, new_cp_path)
+
+    def rename_all_checkpoints(self, old_path, new_path):
+        """Rename the checkpoints of a file, or of every file under a renamed directory"""
+        if not self.fs.isdir(new_path):
+            return super(GenericCheckpoints, self).rename_all_checkpoints(old_path, new_path)
+        old_path, new_path = old_path.strip("/"), new_path.strip("/")
+        for path in self.list_files(new_path):
+            old_file = old_path + path[len(new_path):]
+            super(GenericCheckpoints, self).rename_all_checkpoints(old_file, path)
+
+    def list_files(self, path):
+        """Paths of the files under a directory, at any depth"""
+        files = []
+        for info in self.fs.ls(path, detail=True):
+            if info.type == "directory":
+                files.extend(self.list_files(info.path))
+            elif posixpath.basename(info.path) != self.fs.dir_keep_file:
+                files.append(info.path)
+        return files
+
+    def delete_checkpoint(self, checkpoint_id, path):
+        cp_path = self.checkpoint_path(checkpoint_id, path)
+        if not self.fs.isfile(cp_path):
+            self.no_such_checkpoint(path, checkpoint_id)
+        self.log.debug("S3contents.Checkpoints: Deleting checkpoint `%s`", cp_path)
+        self.fs.rm(cp_path)
+
+    def list_checkpoints(self, path):
+        checkpoint_id = self.checkpoint_id
+        info = self.fs.stat(self.checkpoint_path(checkpoint_id, path))
+        if info.type != "file":
+            return []
+        return [self.checkpoint_model(checkpoint_id, info)]
+
+
+class S3Checkpoints(GenericCheckpoints):
+    """Checkpoints stored in the S3 bucket, created and restored with CopyObject"""
+
+
+class GCSCheckpoints(GenericCheckpoints):
+    """Checkpoints stored in the GCS bucket, created and restored with a server-side rewrite"""
+
+
+class S3VersionedCheckpoints(Checkpoints):
+    """Checkpoints of a bucket with object versioning enabled.
+
+    Every previous version of an object is a checkpoint: creating a checkpoint returns the current
+    version, listed once the file is saved again, and restoring one is a server-side copy of that
+    version, checkpoints take no extra storage. Deleting a checkpoint deletes the version for good.
+    Versions stay with the key, so checkpoints do not follow a rename.
+    When versioning is not enabled on the bucket the checkpoints are stored on the local disk.
+    """
+
+    max_checkpoints = Integer(
+        10, help="Max number of versions of a file listed as checkpoints, newest first").tag(
+            config=True)
+
+    # Headers of an object given again when it is copied onto itself
+    copied_headers = ("ContentType", "CacheControl", "ContentDisposition", "ContentEncoding",
+                      "ContentLanguage", "Expires", "WebsiteRedirectLocation", "StorageClass")
+
+    def __init__(self, **kwargs):
+        super(S3VersionedCheckpoints, self).__init__(**kwargs)
+        self._versioning = None
+        self._fallback = None
+
+    def get_fs(self):
+        return self.parent.fs
+    fs = property(get_fs)
+
+    def versioning_enabled(self):
+        """Whether the bucket keeps the versions of the objects, checked once"""
+        if self._versioning is None:
+            response = self.fs.fs.s3.get_bucket_versioning(Bucket=self.fs.bucket)
+            self._versioning = response.get("Status") == "Enabled"
+            if not self._versioning:
+                self.log.warning("S3contents.VersionedCheckpoints: Versioning is not enabled on "
+                                 "bucket `%s`, storing checkpoints on the local disk", self.fs.bucket)
+        return self._versioning
+
+    def get_fallback(self):
+        if self._fallback is None:
+            self._fallback = GenericFileCheckpoints(parent=self.parent, log=self.log)
+        return self._fallback
+    fallback = property(get_fallback)
+
+    def key(self, path):
+        _, key = self.fs.split_path(self.fs.path(path))
+        return key
+
+    def checkpoint_model(self, version):
+        return {"id": version["VersionId"], "last_modified": version["LastModified"]}
+
+    def no_such_checkpoint(self, path, checkpoint_id):
+        raise HTTPError(404, u"Checkpoint does not exist: {path}@{checkpoint_id}".format(
+            path=path, checkpoint_id=checkpoint_id))
+
+    def versions(self, path):
+        """Versions (not delete markers) of the object at `path`, newest first"""
+        key = self.key(path)
+        versions = []
+        paginator = self.fs.fs.s3.get_paginator("list_object_versions")
+        for page in paginator.paginate(Bucket=self.fs.bucket, Prefix=key):
+            versions.extend(v for v in page.get("Versions", []) if v["Key"] == key)
+        versions.sort(key=lambda v: v["LastModified"], reverse=True)
+        return versions
+
+    def create_checkpoint(self, contents_mgr, path):
+        if not self.versioning_enabled():
+            return self.fallback.create_checkpoint(contents_mgr, path)
+        self.fs.flush(path)
+        head = self.fs.fs.s3.head_object(Bucket=self.fs.bucket, Key=self.key(path))
+        version_id = head.get("VersionId")
+        if not version_id or version_id == "null":
+            # Written before versioning was enabled: a copy onto itself gives it a version
+            # REPLACE is required to copy an object onto itself, the metadata and headers are kept
+            key = self.key(path)
+            kwargs = dict((name, head[name]) for name in self.copied_headers if name in head)
+            kwargs.update(self.fs.sse_kwargs())
+            self.fs.fs.s3.copy_object(
+                Bucket=self.fs.bucket, Key=key, CopySource={"Bucket": self.fs.bucket, "Key": key},
+                MetadataDirective="REPLACE", Metadata=head.get("Metadata", {}), **kwargs)
+            self.fs.invalidate(path)
+            head = self.fs.fs.s3.head_object(Bucket=self.fs.bucket, Key=self.key(path))
+        self.log.debug("S3contents.VersionedCheckpoints: Checkpoint of `%s` is version `%s`", path,
+                       head["VersionId"])
+        return self.checkpoint_model(head)
+
+    def restore_checkpoint(self, contents_mgr, checkpoint_id, path):
+        if not self.versioning_enabled():
+            return self.fallback.restore_checkpoint(contents_mgr, checkpoint_id, path)
+        # A pending upload would overwrite the restored version
+        self.fs.flush(path)
+        key = self.key(path)
+        self.log.debug("S3contents.VersionedCheckpoints: Restoring `%s` from version `%s`", path,
+                       checkpoint_id)
+        try:
+            self.fs.fs.s3.copy_object(
+                Bucket=self.fs.bucket, Key=key,
+                CopySource={"Bucket": self.fs.bucket, "Key": key, "VersionId": checkpoint_id},
+                **self.fs.sse_kwargs())
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NoSuchVersion",
+                                                           "InvalidArgument"):
+                self.no_such_checkpoint(path, checkpoint_id)
+            raise
+        finally:
+            self.fs.invalidate(path)
+
+    def rename_checkpoint(self, checkpoint_id, old_path, new_path):
+        if not self.versioning_enabled():
+            return self.fallback.rename_checkpoint(checkpoint_id, old_path, new_path)
+        # The versions belong to the old key and are still listed under it
+        self.log.debug("S3contents.VersionedCheckpoints: Version `%s` of `%s` stays with the old path",
+                       checkpoint_id, old_path)
+
+    def delete_checkpoint(self, checkpoint_id, path):
+        if not self.versioning_enabled():
+            return self.fallback.delete_checkpoint(checkpoint_id, path)
+        versions = dict((v["VersionId"], v) for v in self.versions(path))
+        if checkpoint_id not in versions:
+            self.no_such_checkpoint(path, checkpoint_id)
+        if versions[checkpoint_id].get("IsLatest"):
+            raise HTTPError(400, u"Cannot delete the current version of {path}".format(path=path))
+        self.fs.fs.s3.delete_object(Bucket=self.fs.bucket, Key=self.key(path), VersionId=checkpoint_id)
+
+    def list_checkpoints(self, path):
+        if not self.versioning_enabled():
+            return self.fallback.list_checkpoints(path)
+        # The current version is the file itself, not a checkpoint of it
+        versions = [v for v in self.versions(path) if not v.get("IsLatest")]
+        return [self.checkpoint_model(v) for v in versions[:self.max_checkpoints]]
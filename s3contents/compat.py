@@ -1,10 +1,10 @@
 import six
-import s3fs
 
 if six.PY3:
     FileNotFoundError = FileNotFoundError
 else:
     try:
+        import s3fs
         FileNotFoundError = s3fs.core.FileNotFoundError
     except:
         class FileNotFoundError(IOError):
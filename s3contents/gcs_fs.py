@@ -1,10 +1,52 @@
 import os
+import re
+import base64
+import binascii
+import hashlib
+import mimetypes
+import posixpath
 import six
 import gcsfs
+from six.moves.urllib.parse import quote
 
 from s3contents.compat import FileNotFoundError
 from s3contents.ipycompat import Unicode
-from s3contents.genericfs import GenericFS, NoSuchFile
+from s3contents.genericfs import (
+    BatchDeleteError, GenericFS, FileInfo, NoSuchFile, directory, iter_chunks, missing, utcnow)
+
+# JSON API batch requests: https://cloud.google.com/storage/docs/batch
+GCS_BATCH_URL = "https://www.googleapis.com/batch/storage/v1"
+DELETE_BATCH_SIZE = 100
+BATCH_BOUNDARY = "s3contents_batch"
+BATCH_CONTENT_ID_RE = re.compile(r"Content-ID: <response-(\d+)>", re.IGNORECASE)
+BATCH_STATUS_RE = re.compile(r"HTTP/1\.1 (\d{3})[^\r\n]*")
+# gcsfs >= 0.7 is built on the asyncio file systems of fsspec: its `_` methods are coroutines
+# and `walk` yields directories, older releases call the JSON API with requests
+FSSPEC_GCSFS = hasattr(gcsfs.GCSFileSystem, "_cat_file")
+
+
+class GCSWriter(object):
+    """Writer over a gcsfs file in write mode, keeping the size and MD5 of what was written"""
+
+    def __init__(self, f):
+        self.f = f
+        self.size = 0
+        self.md5 = hashlib.md5()
+
+    def write(self, data):
+        self.f.write(data)
+        self.size += len(data)
+        self.md5.update(data)
+
+    def close(self):
+        self.f.close()
+
+    def abort(self):
+        # The resumable upload session expires on its own when the file is never closed
+        discard = getattr(self.f, "discard", None)
+        if discard is not None:
+            discard()
+
 
 class GCSFS(GenericFS):
 
@@ -31,109 +73,273 @@ class GCSFS(GenericFS):
     def __init__(self, log, **kwargs):
         super(GCSFS, self).__init__(**kwargs)
         self.log = log
+        self.metadata_cache.separator = self.block_cache.separator = self.separator
 
         token = os.path.expanduser(self.token)
         self.fs = gcsfs.GCSFileSystem(project=self.project, token=token)
 
-        self.init()
-
     def init(self):
-        self.mkdir("")
-        self.ls("")
-        assert self.isdir(""), "The root directory should exists :)"
+        # Only write the root marker when the bucket prefix does not exist yet
+        if not self.isdir(""):
+            self.mkdir("")
 
     #  GenericFS methods -----------------------------------------------------------------------------------------------
 
-    def ls(self, path):
+    def ls(self, path, detail=False):
         path_ = self.path(path)
         self.log.debug("S3contents.GCSFS: Listing directory: `%s`", path_)
+        if detail:
+            records = self.fs.ls(path_, detail=True)
+            infos = [self.file_info(record) for record in records]
+            for info in infos:
+                self.metadata_cache.put(self.cache_key(info.path), info)
+            return infos
         files = self.fs.ls(path_)
         return self.unprefix(files)
 
-    def isfile(self, path):
-        path_ = self.path(path)
-        is_file = False
-
-        exists = self.fs.exists(path_)
-        if not exists:
-            is_file = False
-        else:
-            try:
-                # Info will fail if path is a dir
-                self.fs.info(path_)
-                is_file = True
-            except FileNotFoundError:
-                pass
-
-        self.log.debug("S3contents.GCSFS: `%s` is a file: %s", path_, is_file)
-        return is_file
-
-    def isdir(self, path):
-        # GCSFS doesnt return exists=True for a directory with no files so
-        # we need to check if the dir_keep_file exists
-        is_dir = self.isfile(path + self.separator + self.dir_keep_file)
-        path_ = self.path(path)
-        self.log.debug("S3contents.GCSFS: `%s` is a directory: %s", path_, is_dir)
-        return is_dir
-
     def mv(self, old_path, new_path):
         self.log.debug("S3contents.GCSFS: Move file `%s` to `%s`", old_path, new_path)
-        self.cp(old_path, new_path)
-        self.rm(old_path)
+        copied = self.copy_tree(old_path, new_path)
+        try:
+            self.delete_paths([src for src, _ in copied])
+        finally:
+            self.invalidate(old_path, recursive=True)
 
     def cp(self, old_path, new_path):
+        self.copy_tree(old_path, new_path)
+
+    def copy_tree(self, old_path, new_path):
+        """Server-side copy (rewrite) of a file or of every object under a directory.
+
+        The directory is listed once and the copies run on `copy_workers` threads.
+        Return the list of `(source path, destination path)` pairs.
+        """
         old_path_, new_path_ = self.path(old_path), self.path(new_path)
         self.log.debug("S3contents.GCSFS: Coping `%s` to `%s`", old_path_, new_path_)
 
-        if self.isdir(old_path):
-            old_dir_path, new_dir_path = old_path, new_path
-            for obj in self.ls(old_dir_path):
-                old_item_path = obj
-                new_item_path = old_item_path.replace(old_dir_path, new_dir_path, 1)
-                self.cp(old_item_path, new_item_path)
-        elif self.isfile(old_path):
-            self.fs.copy(old_path_, new_path_)
+        info = self.stat(old_path)
+        if info.type == "directory":
+            pairs = [(src, new_path_ + src[len(old_path_):]) for src in self.find(old_path_)]
+        elif info.type == "file":
+            pairs = [(old_path_, new_path_)]
+        else:
+            pairs = []
+        self.map_concurrently(lambda pair: self.fs.copy(*pair), pairs)
+        self.invalidate(new_path, recursive=True)
+        return pairs
 
     def rm(self, path):
         path_ = self.path(path)
         self.log.debug("S3contents.GCSFS: Removing: `%s`", path_)
-        if self.isfile(path):
-            self.log.debug("S3contents.GCSFS: Removing file: `%s`", path_)
-            self.fs.rm(path_)
-        elif self.isdir(path):
-            self.log.debug("S3contents.GCSFS: Removing directory: `%s`", path_)
-            files = self.fs.walk(path_)
-            for f in files:
-                self.fs.rm(f)
+        info = self.stat(path)
+        try:
+            if info.type == "file":
+                self.log.debug("S3contents.GCSFS: Removing file: `%s`", path_)
+                self.fs.rm(path_)
+            elif info.type == "directory":
+                self.log.debug("S3contents.GCSFS: Removing directory: `%s`", path_)
+                self.delete_paths(self.find(path_))
+        finally:
+            self.invalidate(path, recursive=True)
 
     def mkdir(self, path):
         path_ = self.path(path, self.dir_keep_file)
-        self.log.debug("S3contents.GCSFS: Making dir (touch): `%s`", path_)
-        self.fs.touch(path_)
+        if self.implicit_dirs and self.has_objects(self.path(path)):
+            self.log.debug("S3contents.GCSFS: `%s` is not empty, skipping the keep file", path_)
+        else:
+            self.log.debug("S3contents.GCSFS: Making dir (touch): `%s`", path_)
+            self.fs.touch(path_)
+        self.invalidate(path)
 
-    def read(self, path):
-        path_ = self.path(path)
-        if not self.isfile(path):
-            raise NoSuchFile(path_)
-        with self.fs.open(path_, mode='rb') as f:
-            content = f.read().decode("utf-8")
-        return content
+    def read_if_changed(self, path, etag=None):
+        # GCS media downloads are not revalidated by ETag: compare it from a fresh metadata request
+        info = self._stat(path)
+        self.metadata_cache.put(info.path, info)
+        if info.type != "file":
+            raise NoSuchFile(self.path(path))
+        if etag is not None and info.etag == etag:
+            return None, etag
+        with self.fs.open(self.path(path), mode='rb') as f:
+            data = f.read()
+        return data, info.etag
 
-    def lstat(self, path):
+    def _read_range(self, path, start, end):
         path_ = self.path(path)
-        info = self.fs.info(path_)
-        ret = {}
-        ret["ST_MTIME"] = info["updated"]
-        return ret
+        self.log.debug("S3contents.GCSFS: Reading bytes %s-%s of `%s`", start, end - 1, path_)
+        try:
+            with self.fs.open(path_, mode='rb', block_size=end - start) as f:
+                f.seek(start)
+                return f.read(end - start)
+        except FileNotFoundError:
+            raise NoSuchFile(path_)
 
     def write(self, path, content):
         path_ = self.path(self.unprefix(path))
         self.log.debug("S3contents.GCSFS: Writing file: `%s`", path_)
-        with self.fs.open(path_, mode='wb') as f:
-            f.write(content.encode("utf-8"))
+        writer = self.open_writer(path)
+        try:
+            for chunk in iter_chunks(content):
+                writer.write(chunk)
+        except Exception:
+            writer.abort()
+            raise
+        return self.close_writer(path, writer)
+
+    def presigned_url(self, path, expires_in, download=False):
+        if not hasattr(self.fs, "sign"):
+            # Signed URLs need gcsfs >= 0.7
+            return None
+        kwargs = {}
+        mimetype = mimetypes.guess_type(path)[0]
+        if mimetype:
+            kwargs["response_type"] = mimetype
+        if download:
+            kwargs["response_disposition"] = 'attachment; filename="{}"'.format(posixpath.basename(path))
+        return self.fs.sign(self.path(path), expiration=expires_in, **kwargs)
+
+    def open_writer(self, path):
+        # gcsfs sends the content with a resumable upload, one block at a time
+        return GCSWriter(self.fs.open(self.path(self.unprefix(path)), mode='wb'))
+
+    def close_writer(self, path, writer):
+        writer.close()
+        self.invalidate(path)
+        # gcsfs does not expose the ETag of the upload response: one metadata request gets it
+        record = self.object_info(self.path(path))
+        if record is not None:
+            info = self.object_file_info(self.cache_key(path), record)
+        else:
+            info = FileInfo(path=self.cache_key(path), type="file", size=writer.size, mtime=utcnow(),
+                            etag=None, md5=writer.md5.hexdigest())
+        self.metadata_cache.put(info.path, info)
+        return info
+
+    def head(self, path):
+        record = self.object_info(self.path(path))
+        if record is None:
+            return None
+        info = self.object_file_info(self.cache_key(path), record)
+        self.metadata_cache.put(info.path, info)
+        return info
+
+    def _stat(self, path):
+        path_ = self.path(path)
+        key = self.cache_key(path)
+        record = self.object_info(path_)
+        if record is not None:
+            self.log.debug("S3contents.GCSFS: `%s` is a file", path_)
+            return self.object_file_info(key, record)
+        if self.implicit_dirs:
+            is_dir = self.has_objects(path_)
+        else:
+            # GCSFS doesnt return exists=True for a directory with no files so
+            # we need to check if the dir_keep_file exists
+            is_dir = self.object_info(self.path(path, self.dir_keep_file)) is not None
+        if is_dir:
+            self.log.debug("S3contents.GCSFS: `%s` is a directory", path_)
+            return directory(key)
+        self.log.debug("S3contents.GCSFS: `%s` does not exist", path_)
+        return missing(key)
 
     #  Utilities -------------------------------------------------------------------------------------------------------
 
+    def delete_paths(self, paths):
+        """Delete objects by full path with JSON API batch requests of 100 deletes.
+        Raise `BatchDeleteError` with the paths that could not be deleted.
+        """
+        paths = list(paths)
+        errors = {}
+        for i in range(0, len(paths), DELETE_BATCH_SIZE):
+            errors.update(self._batch_delete(paths[i:i + DELETE_BATCH_SIZE]))
+        if errors:
+            raise BatchDeleteError(errors)
+
+    def _batch_delete(self, paths):
+        session = None if FSSPEC_GCSFS else getattr(self.fs, "session", None)
+        if not hasattr(session, "post"):
+            # Newer gcsfs releases batch the deletes of a list of paths themselves
+            self.fs.rm(paths)
+            return {}
+
+        parts = []
+        for n, path_ in enumerate(paths):
+            bucket, _, key = path_.partition(self.separator)
+            parts.append(
+                "--{boundary}\r\n"
+                "Content-Type: application/http\r\n"
+                "Content-ID: <{n}>\r\n\r\n"
+                "DELETE /storage/v1/b/{bucket}/o/{key} HTTP/1.1\r\n\r\n".format(
+                    boundary=BATCH_BOUNDARY, n=n, bucket=bucket, key=quote(key, safe="")))
+        parts.append("--{}--\r\n".format(BATCH_BOUNDARY))
+        response = session.post(
+            GCS_BATCH_URL, data="".join(parts),
+            headers={"Content-Type": 'multipart/mixed; boundary="{}"'.format(BATCH_BOUNDARY)})
+        response.raise_for_status()
+
+        # Every part of the multipart/mixed response has the Content-ID of its request
+        # and the status line of the delete
+        errors = {}
+        for part in response.text.split("\r\n--"):
+            content_id = BATCH_CONTENT_ID_RE.search(part)
+            status = BATCH_STATUS_RE.search(part)
+            if content_id is None or status is None:
+                continue
+            code = int(status.group(1))
+            # 404: the object is already gone
+            if code >= 300 and code != 404:
+                errors[paths[int(content_id.group(1))]] = status.group(0).strip()
+        return errors
+
+    def has_objects(self, path_):
+        """Whether there is any object under the directory `path_` (a full path),
+        from a listing of at most one object"""
+        bucket, _, key = path_.partition(self.separator)
+        prefix = key + self.separator if key else None
+        if FSSPEC_GCSFS:
+            listing = self.fs.call("GET", "b/{}/o/", bucket, json_out=True, prefix=prefix, maxResults=1)
+        else:
+            listing = self.fs._call("get", "b/{}/o/", bucket, prefix=prefix, maxResults=1)
+        return bool(listing.get("items"))
+
+    def find(self, path_):
+        """Full paths of every object under the directory `path_` (a full path)"""
+        if FSSPEC_GCSFS:
+            return self.fs.find(path_)
+        return self.fs.walk(path_)
+
+    def object_info(self, path_):
+        """GCS object resource of the full path `path_` or None if there is no such object"""
+        try:
+            # Info will fail if path is a dir
+            record = self.fs.info(path_)
+        except FileNotFoundError:
+            return None
+        if record.get("type") == "directory" or record.get("storageClass") == "DIRECTORY":
+            return None
+        return record
+
+    def cache_key(self, path):
+        return self.unprefix(path)
+
+    def file_info(self, record):
+        """Build a FileInfo from a gcsfs listing record (one GCS objects.list item or prefix)"""
+        name = record.get("path") or record["name"]
+        if not name.startswith(self.bucket + self.separator):
+            name = self.join(self.bucket, name)
+        path = self.unprefix(name)
+        if (record.get("storageClass") == "DIRECTORY" or record.get("type") == "directory"
+                or record["name"].endswith(self.separator)):
+            return directory(path)
+        return self.object_file_info(path, record)
+
+    def object_file_info(self, path, record):
+        """FileInfo of the file `path` from its GCS object resource"""
+        md5 = record.get("md5Hash")
+        if md5:
+            md5 = binascii.hexlify(base64.b64decode(md5)).decode("ascii")
+        return FileInfo(path=path, type="file", size=int(record.get("size", 0)),
+                        mtime=record.get("updated"), etag=record.get("etag"), md5=md5)
+
     def strip(self, path):
         if isinstance(path, six.string_types):
             return path.strip(self.separator)
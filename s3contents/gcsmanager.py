@@ -32,10 +32,17 @@ class GCSContentsManager(GenericContentsManager):
     def __init__(self, *args, **kwargs):
         super(GCSContentsManager, self).__init__(*args, **kwargs)
 
-        self._fs = GCSFS(
+        self._fs = self.cached_fs(GCSFS(
             log=self.log,
             project=self.project,
             token=self.token,
             bucket=self.bucket,
             prefix=self.prefix,
-            separator=self.separator)
+            separator=self.separator,
+            metadata_cache_ttl=self.metadata_cache_ttl,
+            metadata_cache_size=self.metadata_cache_size,
+            copy_workers=self.copy_workers,
+            implicit_dirs=self.implicit_dirs,
+            read_block_size=self.read_block_size,
+            read_ahead_blocks=self.read_ahead_blocks,
+            block_cache_size=self.block_cache_size))
@@ -2,20 +2,144 @@
 Generic FileSystem class to be used by the Content Manager
 """
 
-from s3contents.ipycompat import HasTraits
+import datetime
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import six
+from dateutil.tz import tzutc
+
+from s3contents.cache import ContentCache, MetadataCache
+from s3contents.ipycompat import Bool, Float, HasTraits, Integer
+
+
+class FileInfo(namedtuple("FileInfo", ["path", "type", "size", "mtime", "etag", "md5"])):
+    """Metadata of a single path as returned by the object store.
+
+    `type` is "file", "directory" or None when the path does not exist,
+    `mtime` is the last modified date (None for directories),
+    `md5` is the hex MD5 of the content when the object store provides it
+    """
+    __slots__ = ()
+
+    @property
+    def exists(self):
+        return self.type is not None
+
+
+FileInfo.__new__.__defaults__ = (None, )
+
+
+# Size of the pieces written by the streaming uploads
+CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def iter_chunks(content, size=CHUNK_SIZE):
+    """Yield `content` (text, bytes or an iterable of bytes or text) as bytes of at most `size` bytes
+    (`size` characters for text), so text is never encoded in one piece"""
+    if isinstance(content, (six.text_type, six.binary_type)):
+        for i in range(0, len(content), size):
+            chunk = content[i:i + size]
+            yield chunk.encode("utf-8") if isinstance(chunk, six.text_type) else chunk
+    else:
+        for chunk in content:
+            yield chunk.encode("utf-8") if isinstance(chunk, six.text_type) else chunk
+
+
+def utcnow():
+    return datetime.datetime.utcnow().replace(tzinfo=tzutc())
+
+
+def missing(path):
+    return FileInfo(path=path, type=None, size=0, mtime=None, etag=None)
+
+
+def directory(path):
+    return FileInfo(path=path, type="directory", size=0, mtime=None, etag=None)
 
 
 class GenericFS(HasTraits):
 
-    def ls(self, path=""):
+    metadata_cache_ttl = Float(
+        5.0, help="Seconds to cache the metadata (type, size, mtime) of a path, 0 to disable").tag(
+            config=True)
+    metadata_cache_size = Integer(
+        10000, help="Max number of paths in the metadata cache, 0 to disable").tag(config=True)
+    copy_workers = Integer(
+        8, help="Number of concurrent server-side copies when copying or moving a directory").tag(
+            config=True)
+    read_block_size = Integer(
+        1024 * 1024, help="Size of the blocks of ranged reads").tag(config=True)
+    read_ahead_blocks = Integer(
+        2, help="Number of blocks after a ranged read fetched in the same request").tag(config=True)
+    block_cache_size = Integer(
+        32 * 1024 * 1024, help="Max bytes of blocks of ranged reads kept in memory, 0 to disable").tag(
+            config=True)
+    implicit_dirs = Bool(
+        False, help="Treat any non-empty prefix as a directory (e.g. uploaded by aws s3 sync or gsutil) "
+        "and only write the keep file of empty directories").tag(config=True)
+
+    def __init__(self, **kwargs):
+        super(GenericFS, self).__init__(**kwargs)
+        self.metadata_cache = MetadataCache(ttl=self.metadata_cache_ttl,
+                                            max_entries=self.metadata_cache_size)
+        self.block_cache = ContentCache(max_bytes=self.block_cache_size)
+        self._initialized = False
+        self._init_lock = threading.Lock()
+
+    def init(self):
+        """Make sure the root directory exists"""
         raise NotImplemented("Should be implemented by the file system abstraction")
 
-    def isfile(self, path):
+    def ensure_init(self):
+        """Run `init` once, on first use instead of at construction,
+        so the notebook server does not wait for the bucket to start"""
+        if self._initialized:
+            return
+        with self._init_lock:
+            if not self._initialized:
+                self.init()
+                self._initialized = True
+
+    def ls(self, path="", detail=False):
+        """List the contents of a directory.
+
+        If `detail` is True return a list of `FileInfo` built from the listing response,
+        otherwise return a list of paths.
+        """
         raise NotImplemented("Should be implemented by the file system abstraction")
 
-    def isdir(self, path):
+    def stat(self, path):
+        """Return the `FileInfo` of `path`: file, directory or missing (`type=None`).
+
+        Served from the metadata cache when possible.
+        """
+        key = self.cache_key(path)
+        info = self.metadata_cache.get(key)
+        if info is None:
+            info = self._stat(path)
+            self.metadata_cache.put(key, info)
+        return info
+
+    def head(self, path):
+        """`FileInfo` of the object at `path` from a fresh metadata request, without looking for a
+        directory: None when there is no such object. Updates the metadata cache."""
+        info = self._stat(path)
+        self.metadata_cache.put(info.path, info)
+        return info if info.type == "file" else None
+
+    def _stat(self, path):
+        """Fetch the `FileInfo` of `path` from the object store,
+        with at most one object metadata request and one prefix listing"""
         raise NotImplemented("Should be implemented by the file system abstraction")
 
+    def isfile(self, path):
+        return self.stat(path).type == "file"
+
+    def isdir(self, path):
+        return self.stat(path).type == "directory"
+
     def mv(self, old_path, new_path):
         raise NotImplemented("Should be implemented by the file system abstraction")
 
@@ -29,14 +153,122 @@ class GenericFS(HasTraits):
         raise NotImplemented("Should be implemented by the file system abstraction")
 
     def read(self, path):
+        """Content of the text file `path`"""
+        return self.read_bytes(path).decode("utf-8")
+
+    def read_bytes(self, path):
+        """Raw bytes of the file `path`, raise `NoSuchFile` if it is not a file"""
+        data, _ = self.read_if_changed(path)
+        return data
+
+    def read_if_changed(self, path, etag=None):
+        """Conditional read: return `(data, etag)` with the raw bytes of `path` and their ETag,
+        or `(None, etag)` without downloading anything when the ETag of `path` is still `etag`.
+        """
         raise NotImplemented("Should be implemented by the file system abstraction")
 
-    def lstat(self, path):
+    def read_range(self, path, offset, length):
+        """Up to `length` bytes of the file `path` starting at `offset`.
+
+        The file is read by blocks of `read_block_size` bytes with HTTP Range requests, the missing
+        blocks and the `read_ahead_blocks` following them are fetched in a single request.
+        Blocks are cached and validated by the ETag of the file.
+        """
+        info = self.stat(path)
+        if info.type != "file":
+            raise NoSuchFile(path)
+        end = min(offset + length, info.size)
+        if offset >= end:
+            return b""
+        block_size = self.read_block_size
+        first, last = offset // block_size, (end - 1) // block_size
+        n_blocks = (info.size + block_size - 1) // block_size
+        key = self.cache_key(path) + self.metadata_cache.separator
+
+        blocks, missing_blocks = {}, []
+        for i in range(first, last + 1):
+            entry = self.block_cache.get(key + str(i))
+            if entry is not None and entry.etag == info.etag:
+                blocks[i] = entry.data
+            else:
+                missing_blocks.append(i)
+            self.block_cache.record(hit=i in blocks)
+
+        if missing_blocks:
+            start, stop = missing_blocks[0], min(missing_blocks[-1] + 1 + self.read_ahead_blocks, n_blocks)
+            data = self._read_range(path, start * block_size, min(stop * block_size, info.size))
+            for i in range(start, stop):
+                block = data[(i - start) * block_size:(i - start + 1) * block_size]
+                self.block_cache.put(key + str(i), info.etag, block)
+                if i <= last:
+                    blocks.setdefault(i, block)
+
+        data = b"".join(blocks[i] for i in range(first, last + 1))
+        return data[offset - first * block_size:end - first * block_size]
+
+    def _read_range(self, path, start, end):
+        """Bytes `start` to `end` (excluded) of the file `path` in a single request"""
         raise NotImplemented("Should be implemented by the file system abstraction")
 
+    def lstat(self, path):
+        info = self.stat(path)
+        if info.type != "file":
+            raise NoSuchFile(path)
+        ret = {}
+        ret["ST_MTIME"] = info.mtime
+        return ret
+
     def write(self, path, content):
+        """Write `content` (text, encoded as UTF-8, bytes or an iterable of them) to `path`.
+        Large contents are streamed to the bucket without holding them in memory twice.
+        Return the `FileInfo` of the new object, built from the upload response.
+        """
         raise NotImplemented("Should be implemented by the file system abstraction")
 
+    def write_bytes(self, path, data):
+        """Write the bytes (or iterable of bytes) `data` to `path`, return the `FileInfo` of the new object"""
+        return self.write(path, data)
+
+    def open_writer(self, path):
+        """Writer streaming bytes to `path` with `write(data)`, completed by `close_writer`
+        or cancelled with `abort()`. Nothing is visible at `path` before `close_writer`.
+        """
+        raise NotImplemented("Should be implemented by the file system abstraction")
+
+    def close_writer(self, path, writer):
+        """Complete the upload of a writer from `open_writer`, return the `FileInfo` of the new object"""
+        raise NotImplemented("Should be implemented by the file system abstraction")
+
+    def flush(self, path=None):
+        """Wait for the writes of `path` (all of them if `path` is None) to be in the object store,
+        nothing to do for file systems that upload before `write` returns"""
+
+    def presigned_url(self, path, expires_in, download=False):
+        """Short-lived URL to GET the file `path` directly from the object store,
+        None if the file system cannot sign URLs. With `download` the browser saves the file."""
+        return None
+
+    def map_concurrently(self, func, items):
+        """Call `func` on every item using up to `copy_workers` threads, return the results in order.
+        The first exception raised by `func` is re-raised once all the calls are done.
+        """
+        items = list(items)
+        if len(items) <= 1 or self.copy_workers <= 1:
+            return [func(item) for item in items]
+        with ThreadPoolExecutor(max_workers=min(self.copy_workers, len(items))) as executor:
+            futures = [executor.submit(func, item) for item in items]
+        return [future.result() for future in futures]
+
+    def cache_key(self, path):
+        """Normalized path used as key of the metadata cache"""
+        raise NotImplemented("Should be implemented by the file system abstraction")
+
+    def invalidate(self, path, recursive=False):
+        """Drop the cached metadata and blocks of `path` (and everything under it if `recursive`)"""
+        key = self.cache_key(path)
+        self.metadata_cache.invalidate(key, recursive=recursive)
+        self.block_cache.invalidate(key, recursive=True)
+
 
 class GenericFSError(Exception):
     pass
@@ -48,3 +280,12 @@ class NoSuchFile(GenericFSError):
         self.path = path
         self.message = "No such file or directory: {}".format(path)
         super(NoSuchFile, self).__init__(self.message, *args, **kwargs)
+
+
+class BatchDeleteError(GenericFSError):
+
+    def __init__(self, errors, *args, **kwargs):
+        self.errors = errors
+        self.message = "Could not delete {} objects: {}".format(
+            len(errors), ", ".join("{} ({})".format(path, error) for path, error in sorted(errors.items())[:10]))
+        super(BatchDeleteError, self).__init__(self.message, *args, **kwargs)
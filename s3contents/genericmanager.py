@@ -1,29 +1,228 @@
 import os
-import json
 import mimetypes
+import atexit
+import codecs
 import datetime
+import functools
+import hashlib
+import json
+import multiprocessing
+import sys
+import threading
+import time
+from base64 import b64decode, b64encode
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 from tornado.web import HTTPError
 
-from s3contents.genericfs import GenericFSError, NoSuchFile
-from s3contents.ipycompat import ContentsManager
-from s3contents.ipycompat import HasTraits, Unicode
-from s3contents.ipycompat import reads, from_dict, GenericFileCheckpoints
+from s3contents.cache import ContentCache, MetadataCache, SingleFlight
+from s3contents.cached_fs import CachedFS
+from s3contents.checkpoints import GenericCheckpoints
+from s3contents.genericfs import BatchDeleteError, FileInfo, GenericFSError, NoSuchFile, utcnow
+from s3contents.ipycompat import CONTENTS_FUTURES, ContentsManager
+from s3contents.ipycompat import Bool, Float, HasTraits, Integer, Unicode
+from s3contents.ipycompat import convert, from_dict, get_version, nbformat_versions, GenericFileCheckpoints
+from s3contents.ipycompat import ValidationError, validate as validate_nb
+from s3contents.serializers import get_serializer
 
 DUMMY_CREATED_DATE = datetime.datetime.fromtimestamp(0)
 NBFORMAT_VERSION = 4
+# Mimetypes of text files not under text/
+TEXT_MIMETYPES = {"application/json", "application/javascript", "application/x-sh", "application/xml",
+                  "application/x-yaml", "image/svg+xml"}
+# Chunked uploads without a new chunk for this long are aborted
+CHUNKED_UPLOAD_TIMEOUT = 3600
+
+# Set in the thread pool workers so nested calls (e.g. `save` calling `get`) run inline
+_offloaded = threading.local()
+
+
+def new_process_pool(max_workers):
+    """Process pool whose workers are spawned: a fork of the server would copy the locks held by its
+    other threads"""
+    if sys.version_info >= (3, 7):
+        return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+    return ProcessPoolExecutor(max_workers=max_workers)
+
+
+def offload(method):
+    """Run `method` in the manager thread pool and return a Future when `thread_pool_size` > 0.
+
+    Calls made from inside a pool worker run inline and return their result directly.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self._executor is None or getattr(_offloaded, "active", False):
+            return method(self, *args, **kwargs)
+        return self._submit(method, self, *args, **kwargs)
+    return wrapper
 
 
 class GenericContentsManager(ContentsManager, HasTraits):
 
-    # This makes the checkpoints get saved on this directory
+    # Local directory of the default file checkpoints, unused by the checkpoints in the bucket
     root_dir = Unicode("./", config=True)
 
+    metadata_cache_ttl = Float(
+        5.0, help="Seconds to cache the metadata (type, size, mtime) of a path, 0 to disable").tag(
+            config=True)
+    metadata_cache_size = Integer(
+        10000, help="Max number of paths in the metadata cache, 0 to disable").tag(config=True)
+
+    copy_workers = Integer(
+        8, help="Number of concurrent server-side copies when copying or moving a directory").tag(
+            config=True)
+
+    implicit_dirs = Bool(
+        False, help="Treat any non-empty prefix as a directory (e.g. uploaded by aws s3 sync or gsutil) "
+        "and only write the keep file of empty directories").tag(config=True)
+
+    notebook_serializer = Unicode(
+        "auto", help="JSON library to parse and serialize notebooks: json, orjson, ujson or auto "
+                     "(the first installed of orjson, ujson and json)").tag(config=True)
+
+    validation_cache_size = Integer(
+        1024, help="Max number of notebook contents whose validation and trust results are remembered, "
+                   "by digest, so unchanged notebooks are not validated and signed again. 0 to disable").tag(
+            config=True)
+    notebook_validator = Unicode(
+        "", help="JSON schema validator of nbformat, e.g. fastjsonschema (needs nbformat >= 5.1 and "
+                 "fastjsonschema). nbformat has no per-call option: this sets the NBFORMAT_VALIDATOR "
+                 "environment variable of the whole process. Empty to keep the nbformat default").tag(
+            config=True)
+
+    notebook_cache_size = Integer(
+        64 * 1024 * 1024, help="Max bytes of notebooks kept in memory and revalidated by ETag "
+                               "on every open, 0 to disable").tag(config=True)
+
+    read_block_size = Integer(
+        1024 * 1024, help="Size of the blocks of ranged reads").tag(config=True)
+    read_ahead_blocks = Integer(
+        2, help="Number of blocks after a ranged read fetched in the same request").tag(config=True)
+    block_cache_size = Integer(
+        32 * 1024 * 1024, help="Max bytes of blocks of ranged reads kept in memory, 0 to disable").tag(
+            config=True)
+
+    preview_threshold = Integer(
+        0, help="Text files larger than this many bytes are opened as a read-only preview of their "
+                "first `preview_size` bytes, 0 to always return the whole file").tag(config=True)
+    preview_size = Integer(
+        1024 * 1024, help="Number of bytes of the preview of a large text file").tag(config=True)
+
+    presigned_url_expiry = Integer(
+        300, help="Seconds the presigned URLs of the /files redirect handler are valid").tag(config=True)
+    presigned_url_threshold = Integer(
+        10 * 1024 * 1024, help="Files of at least this many bytes are downloaded from a presigned URL "
+                               "by the /files redirect handler, smaller ones go through the server").tag(
+            config=True)
+
+    local_cache_dir = Unicode(
+        "", help="Directory on the local disk (e.g. an SSD) to keep recently used files in and to write "
+                 "files to before they are uploaded, empty to disable").tag(config=True)
+    local_cache_size = Integer(
+        1024 * 1024 * 1024, help="Max bytes of files in the local cache").tag(config=True)
+    local_cache_write_back = Bool(
+        True, help="Acknowledge saves once they are on the local disk and upload them in the background").tag(
+            config=True)
+    local_cache_upload_workers = Integer(
+        2, help="Number of files uploaded concurrently from the local cache").tag(config=True)
+
+    skip_unchanged_saves = Bool(
+        True, help="Do not upload a file when its MD5 matches the one of the object in the bucket, "
+                   "e.g. autosaves of an unchanged notebook").tag(config=True)
+
+    process_pool_size = Integer(
+        0, help="Number of processes to parse and validate large notebooks in, so they do not hold the "
+                "GIL of the server. Validation results are passed back through the validation cache. "
+                "Needs thread_pool_size > 0: the calls wait for the workers, which must not block the "
+                "IOLoop. 0 keeps every notebook in the server process").tag(config=True)
+    process_pool_threshold = Integer(
+        4 * 1024 * 1024, help="Notebooks of at least this many bytes are parsed and validated in the "
+                              "process pool, smaller ones in the server process").tag(config=True)
+
+    thread_pool_size = Integer(
+        0, help="Number of threads to run the contents API calls on, so the IOLoop is not blocked "
+                "while waiting for the bucket. The calls then return futures: needs notebook >= 6 or "
+                "jupyter_server. 0 runs them on the IOLoop").tag(config=True)
+    thread_pool_queue_size = Integer(
+        64, help="Max number of calls waiting for a thread before new ones fail with 503").tag(
+            config=True)
+
     def __init__(self, *args, **kwargs):
         super(GenericContentsManager, self).__init__(*args, **kwargs)
         self._fs = None
+        self.notebook_cache = ContentCache(max_bytes=self.notebook_cache_size)
+        self.serializer = get_serializer(self.notebook_serializer)
+        self._notebook_reads = SingleFlight()
+        # SHA-256 of the notebook bytes -> validation message / trusted
+        self.validation_cache = MetadataCache(ttl=float("inf"), max_entries=self.validation_cache_size)
+        self.trust_cache = MetadataCache(ttl=float("inf"), max_entries=self.validation_cache_size)
+        if self.notebook_validator:
+            # Global: nbformat reads the validator from the environment on every validation
+            os.environ["NBFORMAT_VALIDATOR"] = self.notebook_validator
+        # path -> (writer, time of the last chunk) of the chunked uploads in progress
+        self._uploads = {}
+        self._uploads_lock = threading.Lock()
+        self._process_pool = None
+        self._process_pool_lock = threading.Lock()
+        self._executor = None
+        if self.thread_pool_size > 0:
+            if not CONTENTS_FUTURES:
+                raise ValueError("thread_pool_size needs notebook >= 6 or jupyter_server: the handlers of "
+                                 "older servers use the futures of the contents manager as models")
+            self._executor = ThreadPoolExecutor(max_workers=self.thread_pool_size)
+            self._pool_slots = threading.BoundedSemaphore(
+                self.thread_pool_size + self.thread_pool_queue_size)
+        elif self.process_pool_size > 0:
+            self.log.warning("S3contents: process_pool_size is ignored without thread_pool_size")
+
+    def _use_process_pool(self, data):
+        # Waiting for a worker on the IOLoop would block the server longer than parsing in it
+        return (self.process_pool_size > 0 and self._executor is not None and
+                len(data) >= self.process_pool_threshold)
+
+    def _get_process_pool(self):
+        """Process pool for large notebooks, started on first use and shut down at exit"""
+        with self._process_pool_lock:
+            if self._process_pool is None:
+                self._process_pool = new_process_pool(self.process_pool_size)
+                atexit.register(self._process_pool.shutdown)
+        return self._process_pool
+
+    def _submit(self, func, *args, **kwargs):
+        if not self._pool_slots.acquire(False):
+            self.do_error("Too many pending requests to the contents manager", 503)
+
+        def run():
+            _offloaded.active = True
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _offloaded.active = False
+
+        try:
+            future = self._executor.submit(run)
+        except Exception:
+            self._pool_slots.release()
+            raise
+        future.add_done_callback(lambda f: self._pool_slots.release())
+        return future
+
+    def cached_fs(self, fs):
+        """`fs` behind the local disk cache when `local_cache_dir` is set"""
+        if not self.local_cache_dir:
+            return fs
+        return CachedFS(
+            fs,
+            log=self.log,
+            cache_dir=self.local_cache_dir,
+            cache_size=self.local_cache_size,
+            write_back=self.local_cache_write_back,
+            upload_workers=self.local_cache_upload_workers)
 
     def get_fs(self):
+        if self._fs is not None:
+            self._fs.ensure_init()
         return self._fs
     fs = property(get_fs)
 
@@ -67,6 +266,7 @@ class GenericContentsManager(ContentsManager, HasTraits):
         self.log.debug("S3contents.GenericManager.dir_exists: path('%s')", path)
         return self.fs.isdir(path)
 
+    @offload
     def get(self, path, content=True, type=None, format=None):
         # Get a file or directory model.
         self.log.debug("S3contents.GenericManager.get] path('%s') type(%s) format(%s)", path, type, format)
@@ -104,7 +304,7 @@ class GenericContentsManager(ContentsManager, HasTraits):
             if not self.dir_exists(path):
                 self.no_such_entity(path)
             model["format"] = "json"
-            dir_content = self.fs.ls(path=path)
+            dir_content = self.fs.ls(path=path, detail=True)
             model["content"] = self._convert_file_records(dir_content)
         return model
 
@@ -114,19 +314,86 @@ class GenericContentsManager(ContentsManager, HasTraits):
         """
         model = base_model(path)
         model["type"] = "notebook"
-        if self.fs.isfile(path):
-            model["last_modified"] = model["created"] = self.fs.lstat(path)["ST_MTIME"]
+        info = self.fs.stat(path)
+        if info.type == "file":
+            model["last_modified"] = model["created"] = info.mtime
         else:
             model["last_modified"] = model["created"] = DUMMY_CREATED_DATE
         if content:
-            if not self.fs.isfile(path):
+            if info.type != "file":
                 self.no_such_entity(path)
-            file_content = self.fs.read(path)
-            nb_content = reads(file_content, as_version=NBFORMAT_VERSION)
-            self.mark_trusted_cells(nb_content, path)
+            nb_content, digest = self._read_notebook(path)
+            self._mark_trusted_cells(nb_content, path, digest)
             model["format"] = "json"
             model["content"] = nb_content
+            self._validate_notebook_model(model, digest)
+        return model
+
+    def _read_notebook(self, path):
+        """
+        Read and parse a notebook, reusing the cached notebook when its ETag has not changed.
+        Concurrent reads of the same notebook share a single download and parse.
+        Return the notebook and the SHA-256 digest of its bytes.
+        """
+        (nb, digest, cached), shared = self._notebook_reads.do(path, self._load_notebook, path)
+        if not (cached or shared):
+            return nb, digest
+        # The notebook of the cache and of the concurrent reads is never handed out, the callers
+        # mutate their model (trusted marks, validation, edits): each one gets its own copy.
+        return copy_notebook(nb), digest
+
+    def _load_notebook(self, path):
+        """Return `(notebook, digest, cached)`, the notebook is in the notebook cache if `cached`"""
+        entry = self.notebook_cache.get(path)
+        try:
+            data, etag = self.fs.read_if_changed(path, entry.etag if entry else None)
+        except NoSuchFile:
+            self.no_such_entity(path)
+        self.notebook_cache.record(hit=data is None)
+        if data is None:
+            nb, digest = entry.value
+            return nb, digest, True
+        digest = content_digest(data)
+        if self._use_process_pool(data):
+            validate = self.validation_cache.get(digest) is None
+            self.log.debug("S3contents.GenericManager: Parsing '%s' (%s bytes) in the process pool", path,
+                           len(data))
+            nb, message = self._get_process_pool().submit(
+                load_notebook, data, self.serializer.name, validate).result()
+            if validate:
+                self.validation_cache.put(digest, (message, ))
+        else:
+            nb = parse_notebook(data, self.serializer)
+        return nb, digest, self.notebook_cache.put(path, etag, data, (nb, digest))
+
+    def _mark_trusted_cells(self, nb, path, digest):
+        """`mark_trusted_cells` with the signature check remembered by the digest of the notebook"""
+        trusted = self.trust_cache.get(digest)
+        if trusted is None:
+            trusted = self.notary.check_signature(nb)
+            self.trust_cache.put(digest, trusted)
+        if not trusted:
+            self.log.warning("Notebook %s is not trusted", path)
+        self.notary.mark_cells(nb, trusted)
+
+    def _check_and_sign(self, nb, path, digest):
+        """`check_and_sign` skipped when the notebook with this digest is already signed"""
+        if self.trust_cache.get(digest):
+            return
+        if self.notary.check_cells(nb):
+            self.notary.sign(nb)
+            self.trust_cache.put(digest, True)
+        else:
+            self.log.warning("Notebook %s is not trusted", path)
+
+    def _validate_notebook_model(self, model, digest):
+        """`validate_notebook_model` with the result remembered by the digest of the notebook"""
+        cached = self.validation_cache.get(digest)
+        if cached is None:
             self.validate_notebook_model(model)
+            self.validation_cache.put(digest, (model.get("message"), ))
+        elif cached[0] is not None:
+            model["message"] = cached[0]
         return model
 
     def _file_model_from_path(self, path, content=False, format=None):
@@ -135,51 +402,76 @@ class GenericContentsManager(ContentsManager, HasTraits):
         """
         model = base_model(path)
         model["type"] = "file"
-        if self.fs.isfile(path):
-            model["last_modified"] = model["created"] = self.fs.lstat(path)["ST_MTIME"]
+        info = self.fs.stat(path)
+        if info.type == "file":
+            model["last_modified"] = model["created"] = info.mtime
         else:
             model["last_modified"] = model["created"] = DUMMY_CREATED_DATE
+        if content and self._is_preview(path, info, format):
+            return self._preview_model(model, path, info)
         if content:
             try:
-                content = self.fs.read(path)
+                data = self.fs.read_bytes(path)
             except NoSuchFile as e:
                 self.no_such_entity(e.path)
             except GenericFSError as e:
                 self.do_error(str(e), 500)
-            model["format"] = format or "text"
-            model["content"] = content
-            model["mimetype"] = mimetypes.guess_type(path)[0] or "text/plain"
-            if format == "base64":
-                model["format"] = format or "base64"
-                from base64 import b64decode
-                model["content"] = b64decode(content)
+            try:
+                model["content"], model["format"], model["mimetype"] = file_content(path, data, format)
+            except UnicodeDecodeError:
+                self.do_error("%s is not UTF-8 encoded" % path, 400)
+        return model
+
+    def _is_preview(self, path, info, format):
+        """Is the file too large to be returned whole, and a text file that can be previewed?"""
+        if not 0 < self.preview_threshold < info.size or format == "base64":
+            return False
+        mimetype = mimetypes.guess_type(path)[0]
+        return format == "text" or mimetype is None or is_text_mimetype(mimetype)
+
+    def _preview_model(self, model, path, info):
+        """Model of a large text file with only its first `preview_size` bytes, fetched with a ranged read.
+        The model is not writable so the preview never overwrites the file."""
+        self.log.debug("S3contents.GenericManager: Previewing %s bytes of '%s'", self.preview_size, path)
+        try:
+            data = self.fs.read_range(path, 0, self.preview_size)
+        except NoSuchFile as e:
+            self.no_such_entity(e.path)
+        # An incremental decoder leaves out a character cut by the end of the preview
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        model["content"] = decoder.decode(data, final=False)
+        model["format"] = "text"
+        model["mimetype"] = mimetypes.guess_type(path)[0] or "text/plain"
+        model["writable"] = False
+        model["truncated"] = True
+        model["size"] = info.size
         return model
 
-    def _convert_file_records(self, paths):
+    def _convert_file_records(self, records):
         """
-        Applies _notebook_model_from_s3_path or _file_model_from_s3_path to each entry of `paths`,
-        depending on the result of `guess_type`.
+        Build the models of the entries of a directory from the `FileInfo` records of a single
+        detailed listing, without any additional request per entry.
         """
         ret = []
-        for path in paths:
-            # path = self.fs.remove_prefix(path, self.prefix)  # Remove bucket prefix from paths
-            if os.path.basename(path) == self.fs.dir_keep_file:
+        for record in records:
+            path = record.path
+            if os.path.basename(path) == self.fs.dir_keep_file or self.is_checkpoint_dir(path):
                 continue
-            type_ = self.guess_type(path, allow_directory=True)
-            if type_ == "notebook":
-                ret.append(self._notebook_model_from_path(path, False))
-            elif type_ == "file":
-                ret.append(self._file_model_from_path(path, False, None))
-            elif type_ == "directory":
-                ret.append(self._directory_model_from_path(path, False))
+            if record.type == "directory":
+                ret.append(self._model_from_info(path, "directory", record))
+            elif record.type == "file":
+                type_ = self.guess_type(path, allow_directory=False)
+                ret.append(self._model_from_info(path, type_, record))
             else:
-                self.do_error("Unknown file type %s for file '%s'" % (type_, path), 500)
+                self.do_error("Unknown file type %s for file '%s'" % (record.type, path), 500)
         return ret
 
+    @offload
     def save(self, model, path):
         """Save a file or directory model to path.
         """
         self.log.debug("S3contents.GenericManager: save %s: '%s'", model, path)
+        path = path.strip("/")
         if "type" not in model:
             self.do_error("No model type provided", 400)
         if "content" not in model and model["type"] != "directory":
@@ -188,37 +480,121 @@ class GenericContentsManager(ContentsManager, HasTraits):
         if model["type"] not in ("file", "directory", "notebook"):
             self.do_error("Unhandled contents type: %s" % model["type"], 400)
 
+        validation_message = None
         try:
             if model["type"] == "notebook":
-                validation_message = self._save_notebook(model, path)
+                info, validation_message = self._save_notebook(model, path)
+            elif model["type"] == "file" and model.get("chunk") is not None:
+                info = self._save_chunk(model, path)
             elif model["type"] == "file":
-                validation_message = self._save_file(model, path)
+                info = self._save_file(model, path)
             else:
-                validation_message = self._save_directory(path)
+                info = self._save_directory(path)
+        except HTTPError:
+            raise
         except Exception as e:
             self.log.error("Error while saving file: %s %s", path, e, exc_info=True)
             self.do_error("Unexpected error while saving file: %s %s" % (path, e), 500)
 
-        model = self.get(path, type=model["type"], content=False)
+        # Build the model from the upload response instead of fetching it again
+        model = self._model_from_info(path, model["type"], info)
         if validation_message is not None:
             model["message"] = validation_message
         return model
 
+    def _model_from_info(self, path, type, info):
+        """Build a model without content from the `FileInfo` of `path`"""
+        if type == "directory":
+            return base_directory_model(path)
+        model = base_model(path)
+        model["type"] = type
+        model["last_modified"] = model["created"] = info.mtime or DUMMY_CREATED_DATE
+        return model
+
     def _save_notebook(self, model, path):
-        nb_contents = from_dict(model['content'])
-        self.check_and_sign(nb_contents, path)
-        file_contents = json.dumps(model["content"])
-        self.fs.write(path, file_contents)
-        self.validate_notebook_model(model)
-        return model.get("message")
+        # UTF-8 bytes in one pass, uploaded as they are
+        file_contents = self.serializer.dumps(model["content"])
+        digest = content_digest(file_contents)
+        validation = None
+        if self._use_process_pool(file_contents) and self.validation_cache.get(digest) is None:
+            # Validated in a worker while the notebook is signed and uploaded
+            validation = self._get_process_pool().submit(
+                load_notebook, file_contents, self.serializer.name, True)
+        if not self.trust_cache.get(digest):
+            self._check_and_sign(from_dict(model['content']), path, digest)
+        info = self._write_if_changed(path, file_contents)
+        if validation is not None:
+            self.validation_cache.put(digest, (validation.result()[1], ))
+        self._validate_notebook_model(model, digest)
+        return info, model.get("message")
 
     def _save_file(self, model, path):
-        file_contents = model["content"]
-        self.fs.write(path, file_contents)
+        return self._write_if_changed(path, model_content_bytes(model))
+
+    def _save_chunk(self, model, path):
+        """Save a chunk of a large file uploaded by the frontend in pieces:
+        chunk 1 starts an upload to the bucket, every chunk is streamed to it and chunk -1 completes it.
+        Nothing is visible at `path` before the last chunk.
+        """
+        chunk = model["chunk"]
+        data = model_content_bytes(model)
+        with self._uploads_lock:
+            self._abort_stale_uploads()
+            if chunk == 1:
+                self._abort_upload(path)
+                writer = self.fs.open_writer(path)
+            elif path in self._uploads:
+                writer = self._uploads[path][0]
+            else:
+                self.do_error("No upload in progress for chunk %s of '%s'" % (chunk, path), 400)
+            self._uploads[path] = (writer, time.time())
+
+        try:
+            writer.write(data)
+            if chunk != -1:
+                return FileInfo(path=path, type="file", size=writer.size, mtime=utcnow(), etag=None)
+            with self._uploads_lock:
+                self._uploads.pop(path, None)
+            self.notebook_cache.invalidate(path)
+            return self.fs.close_writer(path, writer)
+        except Exception:
+            with self._uploads_lock:
+                self._abort_upload(path)
+            raise
+
+    def _abort_upload(self, path):
+        writer, _ = self._uploads.pop(path, (None, None))
+        if writer is not None:
+            self.log.debug("S3contents.GenericManager: Aborting chunked upload of '%s'", path)
+            try:
+                writer.abort()
+            except Exception as e:
+                self.log.warning("Error while aborting the upload of %s: %s", path, e)
+
+    def _abort_stale_uploads(self):
+        now = time.time()
+        for path, (_, last_chunk) in list(self._uploads.items()):
+            if now - last_chunk > CHUNKED_UPLOAD_TIMEOUT:
+                self._abort_upload(path)
+
+    def _write_if_changed(self, path, data):
+        """Upload `data` to `path` unless the object there already has the same MD5.
+        The MD5 of the object comes from a fresh HEAD request, without a directory listing: the
+        metadata cache may not have seen another client overwrite the object. Return the `FileInfo`
+        of the object.
+        """
+        if self.skip_unchanged_saves:
+            info = self.fs.head(path)
+            if info is not None and info.md5 == hashlib.md5(data).hexdigest():
+                self.log.debug("S3contents.GenericManager: '%s' is unchanged, skipping upload", path)
+                return info
+        self.notebook_cache.invalidate(path)
+        return self.fs.write(path, data)
 
     def _save_directory(self, path):
         self.fs.mkdir(path)
 
+    @offload
     def rename_file(self, old_path, new_path):
         """Rename a file or directory.
 
@@ -226,29 +602,99 @@ class GenericContentsManager(ContentsManager, HasTraits):
         actually moves a file or a directory.
         """
         self.log.debug("S3contents.GenericManager: Init rename of '%s' to '%s'", old_path, new_path)
-        if self.file_exists(new_path) or self.dir_exists(new_path):
+        if self.fs.stat(new_path).exists:
             self.already_exists(new_path)
-        elif self.file_exists(old_path) or self.dir_exists(old_path):
+        elif self.fs.stat(old_path).exists:
             self.log.debug("S3contents.GenericManager: Actually renaming '%s' to '%s'", old_path,
                            new_path)
+            self.notebook_cache.invalidate(old_path, recursive=True)
             self.fs.mv(old_path, new_path)
         else:
             self.no_such_entity(old_path)
 
+    @offload
     def delete_file(self, path):
         """Delete the file or directory at path.
         """
         self.log.debug("S3contents.GenericManager: delete_file '%s'", path)
-        if self.file_exists(path) or self.dir_exists(path):
-            self.fs.rm(path)
+        if self.fs.stat(path).exists:
+            self.notebook_cache.invalidate(path, recursive=True)
+            try:
+                self.fs.rm(path)
+            except BatchDeleteError as e:
+                self.do_error(e.message, 500)
         else:
             self.no_such_entity(path)
 
+    @offload
+    def presigned_url(self, path, download=False):
+        """Presigned URL of the file at `path` for the /files redirect handler, None when the file is
+        hidden, smaller than `presigned_url_threshold` or the file system cannot sign URLs.
+        """
+        if self.is_hidden(path) and not getattr(self, "allow_hidden", False):
+            return None
+        info = self.fs.stat(path)
+        if info.type != "file" or info.size < self.presigned_url_threshold:
+            return None
+        return self.fs.presigned_url(path, self.presigned_url_expiry, download=download)
+
+    # The ContentsManager entry points that call get/save/rename_file/delete_file must run in
+    # the pool as a whole: they expect the models, not the futures.
+
+    @offload
+    def new(self, *args, **kwargs):
+        return super(GenericContentsManager, self).new(*args, **kwargs)
+
+    @offload
+    def new_untitled(self, *args, **kwargs):
+        return super(GenericContentsManager, self).new_untitled(*args, **kwargs)
+
+    @offload
+    def copy(self, *args, **kwargs):
+        return super(GenericContentsManager, self).copy(*args, **kwargs)
+
+    @offload
+    def update(self, *args, **kwargs):
+        return super(GenericContentsManager, self).update(*args, **kwargs)
+
+    @offload
+    def rename(self, *args, **kwargs):
+        return super(GenericContentsManager, self).rename(*args, **kwargs)
+
+    @offload
+    def delete(self, *args, **kwargs):
+        return super(GenericContentsManager, self).delete(*args, **kwargs)
+
+    @offload
+    def trust_notebook(self, *args, **kwargs):
+        result = super(GenericContentsManager, self).trust_notebook(*args, **kwargs)
+        # Notebooks remembered as not trusted may be signed now
+        self.trust_cache.clear()
+        return result
+
+    @offload
+    def create_checkpoint(self, *args, **kwargs):
+        return super(GenericContentsManager, self).create_checkpoint(*args, **kwargs)
+
+    @offload
+    def restore_checkpoint(self, *args, **kwargs):
+        return super(GenericContentsManager, self).restore_checkpoint(*args, **kwargs)
+
     def is_hidden(self, path):
         """Is path a hidden directory or file?
+
+        Only the checkpoints stored in the bucket (and the files under them) are hidden,
+        with the default local checkpoints nothing is.
         """
         self.log.debug("S3contents.GenericManager: is_hidden '%s'", path)
-        return False
+        return self.is_checkpoint_dir(path.strip("/").split("/")[0])
+
+    def is_checkpoint_dir(self, path):
+        """Is path the directory of checkpoints stored in the bucket?
+        """
+        if not isinstance(self.checkpoints, GenericCheckpoints):
+            return False
+        return path.strip("/") == self.checkpoints.checkpoint_dir.strip("/")
 
 
 def base_model(path):
@@ -271,3 +717,74 @@ def base_directory_model(path):
         last_modified=DUMMY_CREATED_DATE,
         created=DUMMY_CREATED_DATE,)
     return model
+
+
+def is_text_mimetype(mimetype):
+    return mimetype.startswith("text/") or mimetype in TEXT_MIMETYPES or mimetype.endswith("+json")
+
+
+def file_content(path, data, format=None):
+    """Content, format and mimetype of the model of the file `path` from its bytes `data`.
+
+    Without a `format` text vs binary is guessed from the mimetype of the name,
+    only files of unknown type try a UTF-8 decode. Raise `UnicodeDecodeError` if `format`
+    is "text" and `data` is not UTF-8.
+    """
+    mimetype = mimetypes.guess_type(path)[0]
+    if format is None:
+        if mimetype is not None:
+            format = "text" if is_text_mimetype(mimetype) else "base64"
+        else:
+            try:
+                return data.decode("utf-8"), "text", "text/plain"
+            except UnicodeDecodeError:
+                format = "base64"
+    if format == "text":
+        return data.decode("utf-8"), "text", mimetype or "text/plain"
+    return b64encode(data).decode("ascii"), "base64", mimetype or "application/octet-stream"
+
+
+def model_content_bytes(model):
+    """Bytes of the content of a file model, decoded once from base64 or text"""
+    if model.get("format") == "base64":
+        return b64decode(model["content"])
+    return model["content"].encode("utf-8")
+
+
+def content_digest(data):
+    """Key of the trust and validation caches: SHA-256 of the notebook bytes. Unlike MD5, used for
+    the ETags, two contents with the same digest cannot be crafted to get one trusted as the other"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def copy_notebook(nb):
+    """Deep copy of a notebook: new dicts and lists, the immutable strings and numbers are shared"""
+    return from_dict(nb)
+
+
+def parse_notebook(data, serializer):
+    """Parse the bytes of a notebook with `serializer` (without decoding them to a str first when it
+    can parse bytes) and convert it to the current nbformat. Validation is left to the model."""
+    nb_dict = serializer.loads(data)
+    major, minor = get_version(nb_dict)
+    if major not in nbformat_versions:
+        raise ValueError("Unsupported nbformat version %s" % major)
+    nb = nbformat_versions[major].to_notebook_json(nb_dict, minor=minor)
+    return convert(nb, NBFORMAT_VERSION)
+
+
+def validation_message(nb):
+    """Message that `validate_notebook_model` sets on the model of `nb`, None when it is valid"""
+    try:
+        validate_nb(nb)
+    except ValidationError as e:
+        return u"Notebook validation failed: {}:\n{}".format(
+            e.message, json.dumps(e.instance, indent=1, default=lambda obj: "<UNKNOWN>"))
+    return None
+
+
+def load_notebook(data, serializer_name, validate=True):
+    """Parse, and validate if `validate`, the bytes of a notebook. Run in the process pool of the
+    contents manager: return the notebook and its validation message."""
+    nb = parse_notebook(data, get_serializer(serializer_name))
+    return nb, validation_message(nb) if validate else None
@@ -0,0 +1,62 @@
+"""
+Server extension redirecting the downloads of large files to presigned URLs of the object store
+
+Enable it with:
+
+    c.NotebookApp.nbserver_extensions = {"s3contents.handlers": True}
+"""
+from concurrent.futures import Future
+
+from tornado import gen, web
+
+from s3contents.genericmanager import GenericContentsManager
+from s3contents.ipycompat import IPY3, NOTEBOOK
+
+if IPY3:
+    from IPython.html.files.handlers import FilesHandler
+    from IPython.html.utils import url_path_join
+elif NOTEBOOK:
+    from notebook.files.handlers import FilesHandler
+    from notebook.utils import url_path_join
+else:
+    from jupyter_server.files.handlers import FilesHandler
+    from jupyter_server.utils import url_path_join
+
+
+class PresignedFilesHandler(FilesHandler):
+    """Answer `/files/<path>` with a redirect to a short-lived presigned URL, so the browser downloads
+    the file directly from the bucket instead of through the notebook server.
+
+    Files smaller than `presigned_url_threshold` of the contents manager, and every file when the
+    contents manager is not an s3contents one or cannot sign URLs, are served as usual.
+    """
+
+    @web.authenticated
+    @gen.coroutine
+    def get(self, path, include_body=True):
+        url = None
+        cm = self.contents_manager
+        if isinstance(cm, GenericContentsManager):
+            # A Future when the contents manager runs its requests in its thread pool
+            url = cm.presigned_url(path.strip("/"), download=bool(self.get_argument("download", False)))
+            if isinstance(url, Future):
+                url = yield url
+        if url is None:
+            result = super(PresignedFilesHandler, self).get(path, include_body=include_body)
+            if result is not None:
+                yield result
+            return
+        self.log.debug("S3contents.PresignedFilesHandler: Redirecting '%s' to a presigned URL", path)
+        self.redirect(url)
+
+
+def _jupyter_server_extension_paths():
+    return [{"module": "s3contents.handlers"}]
+
+
+def load_jupyter_server_extension(nb_server_app):
+    web_app = nb_server_app.web_app
+    route = url_path_join(web_app.settings["base_url"], r"/files/(.*)")
+    # Handlers added by extensions are matched before the ones of the server
+    web_app.add_handlers(".*$", [(route, PresignedFilesHandler)])
+    nb_server_app.log.info("S3contents: /files downloads of large files redirect to presigned URLs")
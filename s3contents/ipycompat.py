@@ -2,15 +2,40 @@
 Utilities for managing IPython 3/4 compat.
 
 Taken from: https://github.com/quantopian/pgcontents/blob/master/pgcontents/utils/ipycompat.py
+
+The flavour is detected from the installed packages without importing IPython:
+the `notebook` package (IPython >= 4, notebook < 7), `jupyter_server`, or IPython 3 which shipped the notebook.
+The contents manager test suites are in `s3contents.tests.utils`.
 """
-import IPython
+try:
+    from importlib.util import find_spec
+except ImportError:
+    # Python 2
+    from pkgutil import find_loader as find_spec
+
+
+def _installed(name):
+    try:
+        return find_spec(name) is not None
+    except ImportError:
+        return False
+
 
-SUPPORTED_VERSIONS = {3, 4, 5, 6}
-IPY_MAJOR = IPython.version_info[0]
-if IPY_MAJOR not in SUPPORTED_VERSIONS:
-    raise ImportError("IPython version %d is not supported." % IPY_MAJOR)
+# notebook >= 7 is a jupyter_server application without `notebook.services`
+NOTEBOOK = _installed("notebook.services")
+JUPYTER_SERVER = not NOTEBOOK and _installed("jupyter_server")
+IPY3 = not NOTEBOOK and not JUPYTER_SERVER and _installed("IPython.html.services")
 
-IPY3 = (IPY_MAJOR == 3)
+if not (NOTEBOOK or JUPYTER_SERVER or IPY3):
+    raise ImportError("s3contents needs one of the notebook (< 7), jupyter_server or IPython 3 packages")
+
+# Whether the handlers of the server wait for futures returned by the contents manager
+# (`thread_pool_size`): notebook >= 6 wraps its calls in `maybe_future`, jupyter_server in `ensure_async`
+if NOTEBOOK:
+    from notebook import version_info as _notebook_version
+    CONTENTS_FUTURES = _notebook_version >= (6, 0)
+else:
+    CONTENTS_FUTURES = JUPYTER_SERVER
 
 if IPY3:
     from IPython.config import Config
@@ -20,10 +45,10 @@ if IPY3:
         GenericCheckpointsMixin,)
     from IPython.html.services.contents.filemanager import FileContentsManager
     from IPython.html.services.contents.filecheckpoints import (GenericFileCheckpoints)
-    from IPython.html.services.contents.tests.test_manager import (TestContentsManager)
-    from IPython.html.services.contents.tests.test_contents_api import (APITest)
     from IPython.html.utils import to_os_path
-    from IPython.nbformat import from_dict, reads, writes
+    from IPython.nbformat import ValidationError, convert, from_dict, reads, validate, writes
+    from IPython.nbformat import versions as nbformat_versions
+    from IPython.nbformat.reader import get_version
     from IPython.nbformat.v4.nbbase import (
         new_code_cell,
         new_markdown_cell,
@@ -34,22 +59,39 @@ if IPY3:
         Any,
         Bool,
         Dict,
+        Float,
         Instance,
         Integer,
         HasTraits,
         Unicode,)
 else:
+    if NOTEBOOK:
+        try:
+            # This is needed for notebook 5.0, 5.1, 5.2(maybe)
+            # https://github.com/jupyter/notebook/issues/2798
+            import notebook.transutils
+        except ImportError:
+            # Will fail in notebook 4.X - its ok
+            pass
+        from notebook.services.contents.checkpoints import (
+            Checkpoints,
+            GenericCheckpointsMixin,)
+        from notebook.services.contents.filemanager import FileContentsManager
+        from notebook.services.contents.filecheckpoints import (GenericFileCheckpoints)
+        from notebook.services.contents.manager import ContentsManager
+        from notebook.utils import to_os_path
+    else:
+        from jupyter_server.services.contents.checkpoints import (
+            Checkpoints,
+            GenericCheckpointsMixin,)
+        from jupyter_server.services.contents.filemanager import FileContentsManager
+        from jupyter_server.services.contents.filecheckpoints import (GenericFileCheckpoints)
+        from jupyter_server.services.contents.manager import ContentsManager
+        from jupyter_server.utils import to_os_path
     from traitlets.config import Config
-    from notebook.services.contents.checkpoints import (
-        Checkpoints,
-        GenericCheckpointsMixin,)
-    from notebook.services.contents.filemanager import FileContentsManager
-    from notebook.services.contents.filecheckpoints import (GenericFileCheckpoints)
-    from notebook.services.contents.manager import ContentsManager
-    from notebook.services.contents.tests.test_manager import (TestContentsManager)
-    from notebook.services.contents.tests.test_contents_api import (APITest)
-    from notebook.utils import to_os_path
-    from nbformat import from_dict, reads, writes
+    from nbformat import ValidationError, convert, from_dict, reads, validate, writes
+    from nbformat import versions as nbformat_versions
+    from nbformat.reader import get_version
     from nbformat.v4.nbbase import (
         new_code_cell,
         new_markdown_cell,
@@ -60,34 +102,40 @@ else:
         Any,
         Bool,
         Dict,
+        Float,
         Instance,
         Integer,
         HasTraits,
         Unicode,)
 
 __all__ = [
-    'APITest',
     'Any',
     'Bool',
+    'CONTENTS_FUTURES',
     'Checkpoints',
     'Config',
     'ContentsManager',
     'Dict',
+    'Float',
     'FileContentsManager',
     'GenericCheckpointsMixin',
     'GenericFileCheckpoints',
     'HasTraits',
     'Instance',
     'Integer',
-    'TestContentsManager',
     'Unicode',
+    'ValidationError',
+    'convert',
     'from_dict',
+    'get_version',
     'new_code_cell',
     'new_markdown_cell',
     'new_notebook',
     'new_raw_cell',
+    'nbformat_versions',
     'reads',
     'strip_transient',
     'to_os_path',
+    'validate',
     'writes',
 ]
@@ -1,12 +1,149 @@
 """
 Utilities to make S3 look like a regular file system
 """
+import hashlib
+import mimetypes
+import posixpath
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import six
 import s3fs
+from botocore.exceptions import ClientError
+from botocore.utils import parse_timestamp
+
+from s3contents.ipycompat import Integer, Unicode
+from s3contents.genericfs import (
+    BatchDeleteError, GenericFS, FileInfo, NoSuchFile, directory, iter_chunks, missing, utcnow)
+
+# Larger objects need a multipart copy
+MAX_COPY_OBJECT_SIZE = 5 * 1024 ** 3
+# Max number of keys in a DeleteObjects request
+DELETE_BATCH_SIZE = 1000
+# Every part of a multipart upload but the last must be at least 5MB
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+def etag_md5(etag):
+    """MD5 of an object from its ETag, None for multipart uploads where the ETag is not the MD5"""
+    if not etag:
+        return None
+    etag = etag.strip('"')
+    if "-" in etag or len(etag) != 32:
+        return None
+    return etag
+
+
+def response_mtime(response):
+    """Time S3 stored an object from the Date header of the PUT (or CompleteMultipartUpload) response,
+    which has no Last-Modified"""
+    try:
+        return parse_timestamp(response["ResponseMetadata"]["HTTPHeaders"]["date"])
+    except (KeyError, ValueError):
+        return utcnow()
+
+
+class MultipartWriter(object):
+    """File-like writer uploading an object in parts of `part_size` bytes
+    with up to `workers` concurrent UploadPart requests.
+
+    At most `workers` parts are in flight plus the one being filled, so the memory used does not
+    depend on the size of the object. Objects smaller than a part are uploaded with a single PutObject.
+    `close` completes the upload, an exception inside the `with` block aborts it.
+    """
+
+    def __init__(self, s3, bucket, key, part_size=MIN_PART_SIZE, workers=4, extra_args=None):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.workers = max(workers, 1)
+        self.extra_args = extra_args or {}
+        self.size = 0
+        self.md5 = hashlib.md5()
+        self.upload_id = None
+        self.response = None
+        self._buffer = bytearray()
+        self._parts = []
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(self.workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, data):
+        self.size += len(data)
+        self.md5.update(data)
+        self._buffer += data
+        while len(self._buffer) >= self.part_size:
+            part = bytes(self._buffer[:self.part_size])
+            del self._buffer[:self.part_size]
+            self._upload_part(part)
+
+    def _upload_part(self, data):
+        if self.upload_id is None:
+            response = self.s3.create_multipart_upload(Bucket=self.bucket, Key=self.key,
+                                                       **self.extra_args)
+            self.upload_id = response["UploadId"]
+            self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        # Blocks while `workers` parts are being uploaded
+        self._slots.acquire()
+        for future in self._parts:
+            if future.done() and future.exception() is not None:
+                self._slots.release()
+                raise future.exception()
+        future = self._executor.submit(self._put_part, len(self._parts) + 1, data)
+        future.add_done_callback(lambda f: self._slots.release())
+        self._parts.append(future)
+
+    def _put_part(self, part_number, data):
+        response = self.s3.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                       PartNumber=part_number, Body=data)
+        return {"PartNumber": part_number, "ETag": response["ETag"]}
+
+    def close(self):
+        """Upload the buffered bytes and complete the upload.
+        Return the response of the PutObject or CompleteMultipartUpload request.
+        """
+        if self.response is not None:
+            return self.response
+        try:
+            if self.upload_id is None:
+                self.response = self.s3.put_object(Bucket=self.bucket, Key=self.key,
+                                                   Body=bytes(self._buffer), **self.extra_args)
+            else:
+                if self._buffer:
+                    self._upload_part(bytes(self._buffer))
+                parts = [future.result() for future in self._parts]
+                self.response = self.s3.complete_multipart_upload(
+                    Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                    MultipartUpload={"Parts": parts})
+        except Exception:
+            self.abort()
+            raise
+        finally:
+            self._buffer = bytearray()
+            self._shutdown()
+        return self.response
+
+    def abort(self):
+        """Abort the multipart upload, S3 drops the parts uploaded so far"""
+        self._shutdown()
+        if self.upload_id is not None and self.response is None:
+            self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+            self.upload_id = None
+
+    def _shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
 
-from s3contents.compat import FileNotFoundError
-from s3contents.ipycompat import Unicode
-from s3contents.genericfs import GenericFS, NoSuchFile
 
 class S3FS(GenericFS):
 
@@ -35,9 +172,16 @@ class S3FS(GenericFS):
     dir_keep_file = Unicode(
         ".s3keep", help="Empty file to create when creating directories").tag(config=True)
 
+    multipart_part_size = Integer(
+        8 * 1024 * 1024, help="Size of the parts of multipart uploads, files larger than one part "
+                              "are streamed in parts (min 5MB)").tag(config=True)
+    multipart_workers = Integer(
+        4, help="Number of parts of a multipart upload sent concurrently").tag(config=True)
+
     def __init__(self, log, **kwargs):
         super(S3FS, self).__init__(**kwargs)
         self.log = log
+        self.metadata_cache.separator = self.block_cache.separator = self.delimiter
 
         client_kwargs = {
             "endpoint_url": self.endpoint_url,
@@ -56,113 +200,270 @@ class S3FS(GenericFS):
                                     config_kwargs=config_kwargs,
                                     s3_additional_kwargs=s3_additional_kwargs)
 
-        self.init()
-
     def init(self):
-        self.mkdir("")
-        self.ls("")
-        self.isdir("")
+        # Only write the root marker when there is nothing under the prefix yet: the listing of
+        # an empty bucket fails, and the root itself is always a directory for `stat`
+        if not self.has_objects(self.dir_key("")):
+            self.mkdir("")
 
     #  GenericFS methods -----------------------------------------------------------------------------------------------
 
-    def ls(self, path=""):
+    def ls(self, path="", detail=False):
         path_ = self.path(path)
         self.log.debug("S3contents.S3FS: Listing directory: `%s`", path_)
+        if detail:
+            records = self.fs.ls(path_, detail=True, refresh=True)
+            infos = [self.file_info(record) for record in records]
+            for info in infos:
+                self.metadata_cache.put(self.cache_key(info.path), info)
+            return infos
         files = self.fs.ls(path_, refresh=True)
         return self.unprefix(files)
 
-    def isfile(self, path):
-        path_ = self.path(path)
-        is_file = False
-
-        exists = self.fs.exists(path_)
-        if not exists:
-            is_file = False
-        else:
-            try:
-                # Info will fail if path is a dir
-                self.fs.info(path_, refresh=True)
-                is_file = True
-            except FileNotFoundError:
-                pass
-
-        self.log.debug("S3contents.S3FS: `%s` is a file: %s", path_, is_file)
-        return is_file
-
-    def isdir(self, path):
-        path_ = self.path(path)
-        is_dir = False
-
-        exists = self.fs.exists(path_)
-        if not exists:
-            is_dir = False
-        else:
-            try:
-                # Info will fail if path is a dir
-                self.fs.info(path_, refresh=True)
-                is_dir = False
-            except FileNotFoundError:
-                is_dir = True
-
-        self.log.debug("S3contents.S3FS: `%s` is a directory: %s", path_, is_dir)
-        return is_dir
-
     def mv(self, old_path, new_path):
         self.log.debug("S3contents.S3FS: Move file `%s` to `%s`", old_path, new_path)
-        self.cp(old_path, new_path)
-        self.rm(old_path)
+        copied = self.copy_tree(old_path, new_path)
+        self.delete_keys([src for src, _ in copied])
+        self.invalidate(old_path, recursive=True)
 
     def cp(self, old_path, new_path):
+        self.copy_tree(old_path, new_path)
+
+    def copy_tree(self, old_path, new_path):
+        """Server-side copy of a file or of every object under a directory.
+
+        The directory is listed once and the CopyObject requests run on `copy_workers` threads.
+        Return the list of `(source key, destination key)` pairs.
+        """
         old_path_, new_path_ = self.path(old_path), self.path(new_path)
         self.log.debug("S3contents.S3FS: Coping `%s` to `%s`", old_path_, new_path_)
+        bucket, old_key = self.split_path(old_path_)
+        _, new_key = self.split_path(new_path_)
 
-        if self.isdir(old_path):
-            old_dir_path, new_dir_path = old_path, new_path
-            for obj in self.ls(old_dir_path):
-                old_item_path = obj
-                new_item_path = old_item_path.replace(old_dir_path, new_dir_path, 1)
-                self.cp(old_item_path, new_item_path)
-        elif self.isfile(old_path):
-            self.fs.copy(old_path_, new_path_)
+        info = self.stat(old_path)
+        if info.type == "directory":
+            objects = self.list_objects(old_key + self.delimiter)
+            pairs = [(key, new_key + key[len(old_key):], size) for key, size in objects]
+        elif info.type == "file":
+            pairs = [(old_key, new_key, info.size)]
+        else:
+            pairs = []
+        self.map_concurrently(lambda pair: self.copy_object(*pair), pairs)
+        self.invalidate(new_path, recursive=True)
+        return [(src, dst) for src, dst, _ in pairs]
+
+    def copy_object(self, src_key, dst_key, size=0):
+        copy_source = {"Bucket": self.bucket, "Key": src_key}
+        if size > MAX_COPY_OBJECT_SIZE:
+            # CopyObject is limited to 5GB, boto3's managed copy does a multipart copy
+            self.fs.s3.copy(copy_source, self.bucket, dst_key, ExtraArgs=self.sse_kwargs() or None)
+        else:
+            self.fs.s3.copy_object(Bucket=self.bucket, Key=dst_key, CopySource=copy_source,
+                                   **self.sse_kwargs())
+
+    def delete_keys(self, keys):
+        """Delete objects by key, 1000 keys per DeleteObjects request.
+        Raise `BatchDeleteError` with the keys that could not be deleted.
+        """
+        errors = {}
+        for i in range(0, len(keys), DELETE_BATCH_SIZE):
+            batch = keys[i:i + DELETE_BATCH_SIZE]
+            response = self.fs.s3.delete_objects(Bucket=self.bucket, Delete={
+                "Objects": [{"Key": key} for key in batch], "Quiet": True})
+            for error in response.get("Errors", []):
+                errors[error["Key"]] = "{}: {}".format(error.get("Code"), error.get("Message"))
+        if errors:
+            raise BatchDeleteError(errors)
 
     def rm(self, path):
         path_ = self.path(path)
         self.log.debug("S3contents.S3FS: Removing: `%s`", path_)
-        if self.isfile(path):
-            self.log.debug("S3contents.S3FS: Removing file: `%s`", path_)
-            self.fs.rm(path_)
-        elif self.isdir(path):
-            self.log.debug("S3contents.S3FS: Removing directory: `%s`", path_)
-            self.fs.rmdir(path_ + self.delimiter, recursive=True)
+        _, key = self.split_path(path_)
+        info = self.stat(path)
+        try:
+            if info.type == "file":
+                self.log.debug("S3contents.S3FS: Removing file: `%s`", path_)
+                self.delete_keys([key])
+            elif info.type == "directory":
+                self.log.debug("S3contents.S3FS: Removing directory: `%s`", path_)
+                self.delete_keys([k for k, _ in self.list_objects(self.dir_key(path))])
+        finally:
+            self.invalidate(path, recursive=True)
 
     def mkdir(self, path):
         path_ = self.path(path, self.dir_keep_file)
-        self.log.debug("S3contents.S3FS: Making dir: `%s`", path_)
-        self.fs.touch(path_)
+        if self.implicit_dirs and self.has_objects(self.dir_key(path)):
+            self.log.debug("S3contents.S3FS: `%s` is not empty, skipping the keep file", path_)
+        else:
+            self.log.debug("S3contents.S3FS: Making dir: `%s`", path_)
+            self.fs.touch(path_)
+        self.invalidate(path)
 
-    def read(self, path):
+    def read_if_changed(self, path, etag=None):
         path_ = self.path(path)
-        if not self.isfile(path):
-            raise NoSuchFile(path_)
-        with self.fs.open(path_, mode='rb') as f:
-            content = f.read().decode("utf-8")
-        return content
+        bucket, key = self.split_path(path_)
+        kwargs = {"IfNoneMatch": etag} if etag else {}
+        try:
+            response = self.fs.s3.get_object(Bucket=bucket, Key=key, **kwargs)
+        except ClientError as e:
+            code = e.response.get("Error", {}).get("Code")
+            if code == "304":
+                self.log.debug("S3contents.S3FS: `%s` not modified", path_)
+                return None, etag
+            if code in ("404", "NoSuchKey"):
+                raise NoSuchFile(path_)
+            raise
+        data = response["Body"].read()
+        info = FileInfo(path=self.cache_key(path), type="file",
+                        size=response.get("ContentLength", len(data)),
+                        mtime=response["LastModified"], etag=response.get("ETag"),
+                        md5=etag_md5(response.get("ETag")))
+        self.metadata_cache.put(info.path, info)
+        return data, info.etag
 
-    def lstat(self, path):
+    def _read_range(self, path, start, end):
         path_ = self.path(path)
-        info = self.fs.info(path_, refresh=True)
-        ret = {}
-        ret["ST_MTIME"] = info["LastModified"]
-        return ret
+        bucket, key = self.split_path(path_)
+        self.log.debug("S3contents.S3FS: Reading bytes %s-%s of `%s`", start, end - 1, path_)
+        try:
+            response = self.fs.s3.get_object(Bucket=bucket, Key=key,
+                                             Range="bytes={}-{}".format(start, end - 1))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                raise NoSuchFile(path_)
+            raise
+        return response["Body"].read()
 
     def write(self, path, content):
         path_ = self.path(self.unprefix(path))
         self.log.debug("S3contents.S3FS: Writing file: `%s`", path_)
-        with self.fs.open(path_, mode='wb') as f:
-            f.write(content.encode("utf-8"))
+        bucket, key = self.split_path(path_)
+        if isinstance(content, (six.text_type, six.binary_type)) and len(content) < self.multipart_part_size:
+            if isinstance(content, six.text_type):
+                content = content.encode("utf-8")
+            response = self.fs.s3.put_object(Bucket=bucket, Key=key, Body=content, **self.sse_kwargs())
+            size, md5 = len(content), hashlib.md5(content).hexdigest()
+        else:
+            writer = self.open_writer(path)
+            try:
+                for chunk in iter_chunks(content, self.multipart_part_size):
+                    writer.write(chunk)
+            except Exception:
+                writer.abort()
+                raise
+            return self.close_writer(path, writer)
+        info = FileInfo(path=self.cache_key(path), type="file", size=size, mtime=response_mtime(response),
+                        etag=response.get("ETag"), md5=md5)
+        self.invalidate(path)
+        self.metadata_cache.put(info.path, info)
+        return info
+
+    def presigned_url(self, path, expires_in, download=False):
+        bucket, key = self.split_path(self.path(path))
+        params = {"Bucket": bucket, "Key": key}
+        # Objects are uploaded without a Content-Type: set it on the response
+        mimetype = mimetypes.guess_type(path)[0]
+        if mimetype:
+            params["ResponseContentType"] = mimetype
+        if download:
+            params["ResponseContentDisposition"] = 'attachment; filename="{}"'.format(
+                posixpath.basename(key))
+        return self.fs.s3.generate_presigned_url("get_object", Params=params, ExpiresIn=expires_in)
+
+    def open_writer(self, path):
+        bucket, key = self.split_path(self.path(self.unprefix(path)))
+        return MultipartWriter(self.fs.s3, bucket, key, part_size=self.multipart_part_size,
+                               workers=self.multipart_workers, extra_args=self.sse_kwargs())
+
+    def close_writer(self, path, writer):
+        response = writer.close()
+        info = FileInfo(path=self.cache_key(path), type="file", size=writer.size,
+                        mtime=response_mtime(response), etag=response.get("ETag"),
+                        md5=writer.md5.hexdigest())
+        self.invalidate(path)
+        self.metadata_cache.put(info.path, info)
+        return info
+
+    def head(self, path):
+        info = self._head(path)
+        if info is not None:
+            self.metadata_cache.put(info.path, info)
+        return info
+
+    def _head(self, path):
+        """`FileInfo` of the object at `path` from a HeadObject request, None on 404"""
+        bucket, obj_key = self.split_path(self.path(path))
+        if not obj_key:
+            return None
+        try:
+            head = self.fs.s3.head_object(Bucket=bucket, Key=obj_key)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") not in ("404", "NoSuchKey", "NotFound"):
+                raise
+            return None
+        return FileInfo(path=self.cache_key(path), type="file", size=head.get("ContentLength", 0),
+                        mtime=head["LastModified"], etag=head.get("ETag"), md5=etag_md5(head.get("ETag")))
+
+    def _stat(self, path):
+        path_ = self.path(path)
+        key = self.cache_key(path)
+        bucket, obj_key = self.split_path(path_)
+        if obj_key:
+            info = self._head(path)
+            if info is not None:
+                self.log.debug("S3contents.S3FS: `%s` is a file", path_)
+                return info
+            obj_key += self.delimiter
+
+        # Not an object: it is a directory if there is anything under the prefix
+        if not obj_key or self.has_objects(obj_key):
+            self.log.debug("S3contents.S3FS: `%s` is a directory", path_)
+            return directory(key)
+        self.log.debug("S3contents.S3FS: `%s` does not exist", path_)
+        return missing(key)
 
     #  Utilities -------------------------------------------------------------------------------------------------------
 
+    def cache_key(self, path):
+        return self.unprefix(path).strip(self.delimiter)
+
+    def has_objects(self, prefix):
+        """Whether there is any object under the key `prefix`, from a listing of at most one key"""
+        listing = self.fs.s3.list_objects_v2(Bucket=self.bucket, Prefix=prefix, MaxKeys=1)
+        return listing.get("KeyCount", len(listing.get("Contents", []))) > 0
+
+    def dir_key(self, path):
+        """Key prefix of the objects under the directory `path`"""
+        _, key = self.split_path(self.path(path))
+        return key + self.delimiter if key else ""
+
+    def list_objects(self, prefix):
+        """`(key, size)` of every object under `prefix`, recursively, from a single paginated listing"""
+        objects = []
+        paginator = self.fs.s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            objects.extend((obj["Key"], obj.get("Size", 0)) for obj in page.get("Contents", []))
+        return objects
+
+    def sse_kwargs(self):
+        if self.sse:
+            return {"ServerSideEncryption": self.sse}
+        return {}
+
+    def split_path(self, path_):
+        """Split a full path (as returned by `self.path`) into bucket and key"""
+        bucket, _, key = path_.partition(self.delimiter)
+        return bucket, key
+
+    def file_info(self, record):
+        """Build a FileInfo from an s3fs listing record (one ListObjectsV2 entry)"""
+        path = self.unprefix(record["Key"].rstrip(self.delimiter))
+        if record.get("StorageClass") == "DIRECTORY":
+            return directory(path)
+        return FileInfo(path=path, type="file", size=record.get("Size", 0),
+                        mtime=record.get("LastModified"), etag=record.get("ETag"),
+                        md5=etag_md5(record.get("ETag")))
+
     def get_prefix(self):
         """Full prefix: bucket + optional prefix"""
         prefix = self.bucket
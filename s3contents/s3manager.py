@@ -1,4 +1,4 @@
-from s3contents.ipycompat import Unicode
+from s3contents.ipycompat import Integer, Unicode
 
 from s3contents.s3_fs import S3FS
 from s3contents.genericmanager import GenericContentsManager
@@ -27,10 +27,16 @@ class S3ContentsManager(GenericContentsManager):
     delimiter = Unicode("/", help="Path delimiter").tag(config=True)
     sse = Unicode(help="Type of server-side encryption to use").tag(config=True)
 
+    multipart_part_size = Integer(
+        8 * 1024 * 1024, help="Size of the parts of multipart uploads, files larger than one part "
+                              "are streamed in parts (min 5MB)").tag(config=True)
+    multipart_workers = Integer(
+        4, help="Number of parts of a multipart upload sent concurrently").tag(config=True)
+
     def __init__(self, *args, **kwargs):
         super(S3ContentsManager, self).__init__(*args, **kwargs)
 
-        self._fs = S3FS(
+        self._fs = self.cached_fs(S3FS(
             log=self.log,
             access_key_id=self.access_key_id,
             secret_access_key=self.secret_access_key,
@@ -40,4 +46,13 @@ class S3ContentsManager(GenericContentsManager):
             prefix=self.prefix,
             signature_version=self.signature_version,
             delimiter=self.delimiter,
-            sse=self.sse)
+            sse=self.sse,
+            metadata_cache_ttl=self.metadata_cache_ttl,
+            metadata_cache_size=self.metadata_cache_size,
+            copy_workers=self.copy_workers,
+            implicit_dirs=self.implicit_dirs,
+            read_block_size=self.read_block_size,
+            read_ahead_blocks=self.read_ahead_blocks,
+            block_cache_size=self.block_cache_size,
+            multipart_part_size=self.multipart_part_size,
+            multipart_workers=self.multipart_workers))
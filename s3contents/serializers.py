@@ -0,0 +1,83 @@
+"""
+JSON serializers of notebooks: `dumps` produces the UTF-8 bytes that are uploaded in a single pass
+and `loads` parses the downloaded bytes
+
+The serializers write compact JSON with the keys in the order of the model. Strings, integers
+and most floats give the same bytes with all of them, but the floats written with an exponent
+(json `1e-05`, orjson `0.00001`) and NaN or Infinity (orjson writes `null`) do not: after a switch
+of serializer an unchanged notebook holding such values is uploaded once more.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+class JSONSerializer(object):
+    """Standard library serializer"""
+
+    name = "json"
+
+    def dumps(self, obj):
+        return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+    def loads(self, data):
+        return json.loads(data.decode("utf-8"))
+
+
+class OrjsonSerializer(object):
+    """orjson serializer: writes UTF-8 bytes directly, without an intermediate str"""
+
+    name = "orjson"
+
+    def __init__(self):
+        if orjson is None:
+            raise ImportError("The orjson serializer needs the orjson package")
+
+    def dumps(self, obj):
+        return orjson.dumps(obj)
+
+    def loads(self, data):
+        # Parses the bytes directly, without decoding them to a str first
+        return orjson.loads(data)
+
+
+class UjsonSerializer(object):
+    """ujson serializer: parses bytes directly"""
+
+    name = "ujson"
+
+    def __init__(self):
+        if ujson is None:
+            raise ImportError("The ujson serializer needs the ujson package")
+
+    def dumps(self, obj):
+        return ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False).encode("utf-8")
+
+    def loads(self, data):
+        return ujson.loads(data)
+
+
+SERIALIZERS = {
+    "json": JSONSerializer,
+    "orjson": OrjsonSerializer,
+    "ujson": UjsonSerializer,
+}
+
+
+def get_serializer(name="auto"):
+    """Serializer called `name`, "auto" is the first installed of orjson, ujson and json"""
+    if name == "auto":
+        name = "orjson" if orjson is not None else "ujson" if ujson is not None else "json"
+    try:
+        return SERIALIZERS[name]()
+    except KeyError:
+        raise ValueError("Unknown notebook serializer: '{}', use one of: auto, {}".format(
+            name, ", ".join(sorted(SERIALIZERS))))
@@ -0,0 +1,179 @@
+import asyncio
+
+import boto3
+import pytest
+import requests
+
+pytest.importorskip("aiobotocore")
+pytest.importorskip("jupyter_server")
+moto_server = pytest.importorskip("moto.server")
+
+from tornado.web import HTTPError  # noqa: E402
+
+from s3contents import AsyncS3ContentsManager  # noqa: E402
+from s3contents.ipycompat import new_markdown_cell, new_notebook  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def endpoint_url():
+    server = moto_server.ThreadedMotoServer(ip_address="127.0.0.1", port=0)
+    server.start()
+    host, port = server.get_host_and_port()
+    yield "http://{}:{}".format(host, port)
+    server.stop()
+
+
+@pytest.fixture
+def contents_manager(endpoint_url):
+    requests.post(endpoint_url + "/moto-api/reset")
+    s3 = boto3.client("s3", endpoint_url=endpoint_url, region_name="us-east-1",
+                      aws_access_key_id="testing", aws_secret_access_key="testing")
+    s3.create_bucket(Bucket="notebooks")
+    return AsyncS3ContentsManager(
+        access_key_id="testing",
+        secret_access_key="testing",
+        endpoint_url=endpoint_url,
+        bucket="notebooks")
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def save_text(cm, path, text):
+    return cm.save({"type": "file", "format": "text", "content": text}, path)
+
+
+def test_save_and_get(contents_manager):
+    cm = contents_manager
+
+    async def check():
+        nb = new_notebook(cells=[new_markdown_cell(u"# Hello √")])
+        model = await cm.save({"type": "notebook", "content": nb}, "nb.ipynb")
+        assert model["path"] == "nb.ipynb"
+        model = await cm.get("nb.ipynb")
+        assert model["type"] == "notebook"
+        assert model["content"].cells[0].source == u"# Hello √"
+
+        await save_text(cm, "file.txt", u"text √")
+        model = await cm.get("file.txt")
+        assert model["format"] == "text"
+        assert model["content"] == u"text √"
+        await cm.fs.close()
+    run(check())
+
+
+def test_list(contents_manager):
+    cm = contents_manager
+
+    async def check():
+        await cm.save({"type": "directory"}, "dir")
+        await save_text(cm, "dir/a.txt", u"a")
+        await save_text(cm, "b.txt", u"b")
+        model = await cm.get("")
+        assert sorted(item["path"] for item in model["content"]) == ["b.txt", "dir"]
+        model = await cm.get("dir")
+        assert [item["path"] for item in model["content"]] == ["dir/a.txt"]
+        await cm.fs.close()
+    run(check())
+
+
+def test_rename(contents_manager):
+    cm = contents_manager
+
+    async def check():
+        await cm.save({"type": "directory"}, "dir")
+        await save_text(cm, "dir/a.txt", u"a")
+        await cm.rename_file("dir", "moved")
+        assert not await cm.dir_exists("dir")
+        assert (await cm.get("moved/a.txt"))["content"] == u"a"
+        await cm.rename_file("moved/a.txt", "a.txt")
+        assert not await cm.file_exists("moved/a.txt")
+        assert await cm.file_exists("a.txt")
+        await cm.fs.close()
+    run(check())
+
+
+def test_delete(contents_manager):
+    cm = contents_manager
+
+    async def check():
+        await cm.save({"type": "directory"}, "dir")
+        await save_text(cm, "dir/a.txt", u"a")
+        await save_text(cm, "b.txt", u"b")
+        await cm.delete_file("b.txt")
+        assert not await cm.file_exists("b.txt")
+        await cm.delete_file("dir")
+        assert not await cm.dir_exists("dir")
+        assert (await cm.get(""))["content"] == []
+        await cm.fs.close()
+    run(check())
+
+
+def test_root_marker_only_written_to_empty_prefix(contents_manager, endpoint_url):
+    s3 = boto3.client("s3", endpoint_url=endpoint_url, region_name="us-east-1",
+                      aws_access_key_id="testing", aws_secret_access_key="testing")
+    s3.put_object(Bucket="notebooks", Key="synced/file.txt", Body=b"file")
+    cm = contents_manager
+
+    async def check():
+        await cm.get("")
+        await cm.fs.close()
+    run(check())
+    keys = [obj["Key"] for obj in s3.list_objects_v2(Bucket="notebooks")["Contents"]]
+    assert keys == ["synced/file.txt"]
+
+
+def test_large_object_copied_in_parts(contents_manager, monkeypatch):
+    from s3contents import async_s3_fs
+    monkeypatch.setattr(async_s3_fs, "MAX_COPY_OBJECT_SIZE", 4)
+    monkeypatch.setattr(async_s3_fs, "COPY_PART_SIZE", 5 * 1024 * 1024)
+    cm = contents_manager
+    text = u"x" * (6 * 1024 * 1024)
+
+    async def check():
+        await save_text(cm, "large.txt", text)
+        await cm.rename_file("large.txt", "moved.txt")
+        assert (await cm.get("moved.txt"))["content"] == text
+        assert not await cm.file_exists("large.txt")
+        await cm.fs.close()
+    run(check())
+
+
+def test_failed_deletes_reported(contents_manager):
+    cm = contents_manager
+
+    async def delete_objects(**kwargs):
+        return {"Errors": [{"Key": obj["Key"], "Code": "AccessDenied", "Message": "Access Denied"}
+                           for obj in kwargs["Delete"]["Objects"]]}
+
+    async def check():
+        await cm.save({"type": "directory"}, "dir")
+        await save_text(cm, "dir/a.txt", u"a")
+        client = await cm.fs.client()
+        client.delete_objects = delete_objects
+        with pytest.raises(HTTPError) as e:
+            await cm.delete_file("dir")
+        assert e.value.status_code == 500
+        assert "AccessDenied" in e.value.log_message
+        await cm.fs.close()
+    run(check())
+
+
+def test_save_errors_keep_their_status(contents_manager):
+    cm = contents_manager
+
+    async def forbidden(model, path):
+        cm.do_error("Forbidden", 403)
+    cm._save_file = forbidden
+
+    async def check():
+        with pytest.raises(HTTPError) as e:
+            await save_text(cm, "file.txt", u"text")
+        assert e.value.status_code == 403
+        await cm.fs.close()
+    run(check())
@@ -0,0 +1,104 @@
+import threading
+import time
+
+from s3contents.cache import ContentCache, MetadataCache, SingleFlight
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_metadata_cache_ttl():
+    clock = FakeClock()
+    cache = MetadataCache(ttl=5, max_entries=10, clock=clock)
+    cache.put("a/b", "info")
+    assert cache.get("a/b") == "info"
+    clock.now = 6
+    assert cache.get("a/b") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_metadata_cache_lru_eviction():
+    cache = MetadataCache(ttl=5, max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_metadata_cache_invalidate():
+    cache = MetadataCache(ttl=5, max_entries=10)
+    for key in ["", "a", "a/b", "a/b/c", "a/bc", "d"]:
+        cache.put(key, key)
+    cache.invalidate("a/b", recursive=True)
+    assert cache.get("") is None
+    assert cache.get("a") is None
+    assert cache.get("a/b") is None
+    assert cache.get("a/b/c") is None
+    assert cache.get("a/bc") == "a/bc"
+    assert cache.get("d") == "d"
+
+
+def test_metadata_cache_disabled():
+    cache = MetadataCache(ttl=0)
+    cache.put("a", 1)
+    assert cache.get("a") is None
+
+
+def test_content_cache_bytes_bound():
+    cache = ContentCache(max_bytes=10)
+    assert cache.put("a", "etag-a", b"1234")
+    assert cache.put("b", "etag-b", b"5678")
+    assert cache.put("c", "etag-c", b"90ab")
+    assert cache.get("a") is None
+    assert cache.get("b").etag == "etag-b"
+    assert cache.stats()["bytes"] == 8
+    assert not cache.put("d", "etag-d", b"x" * 11)
+
+
+def test_content_cache_invalidate():
+    cache = ContentCache(max_bytes=100)
+    cache.put("dir/a.ipynb", "1", b"{}", value={})
+    cache.put("dir2/b.ipynb", "2", b"{}", value={})
+    cache.invalidate("dir", recursive=True)
+    assert cache.get("dir/a.ipynb") is None
+    assert cache.get("dir2/b.ipynb").value == {}
+    assert cache.stats()["bytes"] == 4
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def load():
+        calls.append(1)
+        started.set()
+        release.wait()
+        return "nb"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do("a", load)))
+    leader.start()
+    started.wait()
+    follower = threading.Thread(target=lambda: results.append(flight.do("a", load)))
+    follower.start()
+    while not flight._calls["a"].waiters:
+        time.sleep(0.001)
+    release.set()
+    leader.join()
+    follower.join()
+
+    assert len(calls) == 1
+    assert sorted(results) == [("nb", True), ("nb", True)]
+    assert flight.do("a", lambda: "new") == ("new", False)
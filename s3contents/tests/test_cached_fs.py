@@ -0,0 +1,154 @@
+import base64
+import hashlib
+import io
+import logging
+
+import pytest
+
+from s3contents.cached_fs import CachedFS
+from s3contents.tests.utils import MemoryFS
+
+log = logging.getLogger(__name__)
+
+
+def cached(tmpdir, fs, **kwargs):
+    return CachedFS(fs, log=log, cache_dir=str(tmpdir), **kwargs)
+
+
+def test_reads_served_from_disk(tmpdir):
+    fs = MemoryFS({"a.txt": b"hello"})
+    cfs = cached(tmpdir, fs)
+    assert cfs.read_bytes("a.txt") == b"hello"
+    assert cfs.read_bytes("a.txt") == b"hello"
+    assert fs.reads == ["a.txt"]
+
+    # Changed in the bucket: downloaded again
+    fs.files["a.txt"] = b"changed"
+    fs.invalidate("a.txt")
+    assert cfs.read_bytes("a.txt") == b"changed"
+    assert fs.reads == ["a.txt", "a.txt"]
+
+
+def test_write_back(tmpdir):
+    fs = MemoryFS()
+    fs.uploading.clear()
+    cfs = cached(tmpdir, fs)
+    info = cfs.write("dir/a.txt", b"hello")
+    assert info.md5 == hashlib.md5(b"hello").hexdigest()
+    # Not uploaded yet, served from the local disk
+    assert cfs.stat("dir/a.txt").type == "file"
+    assert cfs.ls("dir") == ["dir/a.txt"]
+    assert cfs.read_bytes("dir/a.txt") == b"hello"
+    assert cfs.stats()["dirty"] == 1
+
+    fs.uploading.set()
+    cfs.flush()
+    assert fs.files["dir/a.txt"] == b"hello"
+    assert cfs.stats()["dirty"] == 0
+
+
+def test_journal_resumed_after_restart(tmpdir):
+    fs = MemoryFS()
+    fs.uploading.clear()
+    cfs = cached(tmpdir, fs, upload_workers=1)
+    cfs.write("a.txt", b"one")
+    cfs.write("b.txt", b"two")
+
+    # A server of another bucket sharing the cache directory leaves them alone
+    other = MemoryFS(bucket="other")
+    cached(tmpdir, other).flush()
+    assert other.files == {}
+
+    # A new process of the same bucket finds the pending uploads in the journal
+    fs2 = MemoryFS()
+    cfs2 = cached(tmpdir, fs2)
+    cfs2.flush()
+    assert fs2.files == {"a.txt": b"one", "b.txt": b"two"}
+    fs.uploading.set()
+
+
+def test_download_does_not_replace_pending_write(tmpdir):
+    fs = MemoryFS({"a.txt": b"old"})
+    fs.uploading.clear()
+    cfs = cached(tmpdir, fs)
+    cfs.write("a.txt", b"new")
+    # A read of the object in the bucket, finishing after the write
+    cfs._store("a.txt", b"old", fs.etag("a.txt"))
+    assert cfs.read_bytes("a.txt") == b"new"
+    assert cfs.stats() == {"entries": 1, "dirty": 1, "bytes": 3}
+    fs.uploading.set()
+    cfs.flush()
+    assert fs.files["a.txt"] == b"new"
+
+
+def test_rm_uploads_pending_write_first(tmpdir):
+    fs = MemoryFS()
+    cfs = cached(tmpdir, fs)
+    cfs.write("a.txt", b"hello")
+    cfs.rm("a.txt")
+    cfs.flush()
+    assert "a.txt" not in fs.files
+    assert not cfs.isfile("a.txt")
+
+
+def test_lru_eviction_of_clean_files(tmpdir):
+    fs = MemoryFS({"a": b"a" * 10, "b": b"b" * 10, "c": b"c" * 10})
+    cfs = cached(tmpdir, fs, cache_size=25)
+    cfs.read_bytes("a")
+    cfs.read_bytes("b")
+    cfs.read_bytes("a")
+    cfs.read_bytes("c")
+    # "b" is the least recently used
+    assert cfs.stats() == {"entries": 2, "dirty": 0, "bytes": 20}
+    cfs.read_bytes("a")
+    assert fs.reads == ["a", "b", "c"]
+
+
+class FakeGCSFileSystem(object):
+    """gcsfs file system over a dict of objects, counting the downloads"""
+
+    def __init__(self, project=None, token=None):
+        self.objects = {}
+        self.generation = 0
+        self.downloads = []
+
+    def open(self, path, mode="rb", **kwargs):
+        if "w" in mode:
+            return FakeGCSUpload(self, path)
+        self.downloads.append(path)
+        return io.BytesIO(self.objects[path]["data"])
+
+    def info(self, path):
+        if path not in self.objects:
+            raise FileNotFoundError(path)
+        obj = self.objects[path]
+        return {"name": path, "type": "file", "size": len(obj["data"]), "updated": None,
+                "etag": "etag-{}".format(obj["generation"]),
+                "md5Hash": base64.b64encode(hashlib.md5(obj["data"]).digest()).decode("ascii")}
+
+
+class FakeGCSUpload(io.BytesIO):
+
+    def __init__(self, fs, path):
+        super(FakeGCSUpload, self).__init__()
+        self.fs = fs
+        self.path = path
+
+    def close(self):
+        self.fs.generation += 1
+        self.fs.objects[self.path] = {"data": self.getvalue(), "generation": self.fs.generation}
+        super(FakeGCSUpload, self).close()
+
+
+def test_gcs_upload_keeps_the_local_file_valid(tmpdir, monkeypatch):
+    gcs_fs = pytest.importorskip("s3contents.gcs_fs")
+    monkeypatch.setattr(gcs_fs.gcsfs, "GCSFileSystem", FakeGCSFileSystem)
+    fs = gcs_fs.GCSFS(log, bucket="notebooks", token="token")
+    cfs = cached(tmpdir, fs, write_back=False)
+    info = cfs.write("a.txt", b"hello")
+    assert info.etag == fs.fs.info("notebooks/a.txt")["etag"]
+
+    # The ETag of the upload validates the local file: no download
+    fs.invalidate("a.txt")
+    assert cfs.read_bytes("a.txt") == b"hello"
+    assert fs.fs.downloads == []
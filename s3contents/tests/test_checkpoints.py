@@ -0,0 +1,10 @@
+from s3contents.checkpoints import S3Checkpoints
+
+
+def test_checkpoint_path():
+    checkpoints = S3Checkpoints()
+    assert checkpoints.checkpoint_path("checkpoint", "a/b/nb.ipynb") == ".checkpoints/a/b/nb-checkpoint.ipynb"
+    assert checkpoints.checkpoint_path("checkpoint", "/nb.ipynb") == ".checkpoints/nb-checkpoint.ipynb"
+
+    checkpoints.checkpoint_dir = "/ckpt/"
+    assert checkpoints.checkpoint_path("checkpoint", "file.txt") == "ckpt/file-checkpoint.txt"
@@ -0,0 +1,53 @@
+import time
+
+import pytest
+
+from s3contents import S3ContentsManager
+from s3contents.genericmanager import CHUNKED_UPLOAD_TIMEOUT
+from s3contents.s3_fs import MIN_PART_SIZE
+from s3contents.tests.test_multipart import FakeS3
+
+
+@pytest.fixture
+def contents_manager():
+    cm = S3ContentsManager(access_key_id="access-key", secret_access_key="secret-key", bucket="notebooks",
+                           multipart_part_size=MIN_PART_SIZE)
+    cm._fs.fs.s3 = FakeS3()
+    cm._fs._initialized = True
+    return cm
+
+
+def save_chunk(cm, path, chunk, text):
+    return cm.save({"type": "file", "format": "text", "content": text, "chunk": chunk}, path)
+
+
+def test_chunks_uploaded_on_last_chunk(contents_manager):
+    cm = contents_manager
+    s3 = cm.fs.fs.s3
+    save_chunk(cm, "big.txt", 1, u"first ")
+    save_chunk(cm, "big.txt", 2, u"second ")
+    assert s3.puts == []
+    model = save_chunk(cm, "big.txt", -1, u"last")
+    assert s3.puts == [b"first second last"]
+    assert model["path"] == "big.txt"
+    assert cm._uploads == {}
+
+
+def test_chunk_without_upload(contents_manager):
+    with pytest.raises(Exception) as e:
+        save_chunk(contents_manager, "big.txt", 2, u"second")
+    assert e.value.status_code == 400
+
+
+def test_stale_upload_aborted(contents_manager):
+    cm = contents_manager
+    s3 = cm.fs.fs.s3
+    # A full part starts the multipart upload
+    save_chunk(cm, "stale.txt", 1, u"x" * MIN_PART_SIZE)
+    writer, _ = cm._uploads["stale.txt"]
+    assert writer.upload_id is not None
+    cm._uploads["stale.txt"] = (writer, time.time() - CHUNKED_UPLOAD_TIMEOUT - 1)
+
+    save_chunk(cm, "other.txt", 1, u"other")
+    assert s3.aborted
+    assert list(cm._uploads) == ["other.txt"]
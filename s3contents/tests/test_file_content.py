@@ -0,0 +1,33 @@
+from base64 import b64encode
+
+import pytest
+
+from s3contents.genericmanager import file_content, model_content_bytes
+
+PNG = b"\x89PNG\r\n\x1a\n\x00\x00"
+
+
+def test_text_from_mimetype():
+    assert file_content("data.csv", b"a,b\n") == (u"a,b\n", "text", "text/csv")
+
+
+def test_binary_from_mimetype():
+    content, format, mimetype = file_content("image.png", PNG)
+    assert (format, mimetype) == ("base64", "image/png")
+    assert content == b64encode(PNG).decode("ascii")
+
+
+def test_unknown_type_guessed_from_content():
+    assert file_content("Makefile", b"all:\n") == (u"all:\n", "text", "text/plain")
+    assert file_content("data.unknownext", PNG)[1:] == ("base64", "application/octet-stream")
+
+
+def test_explicit_format():
+    assert file_content("data.csv", b"a,b\n", "base64")[1] == "base64"
+    with pytest.raises(UnicodeDecodeError):
+        file_content("image.png", PNG, "text")
+
+
+def test_model_content_bytes():
+    assert model_content_bytes({"format": "base64", "content": b64encode(PNG).decode("ascii")}) == PNG
+    assert model_content_bytes({"format": "text", "content": u"caf\\u00e9"}) == u"caf\\u00e9".encode("utf-8")
@@ -3,7 +3,7 @@ import pytest
 
 from s3contents.tests.utils import GCS_TEST
 from s3contents import GCSContentsManager
-from s3contents.ipycompat import TestContentsManager
+from s3contents.tests.utils import TestContentsManager
 
 
 @GCS_TEST
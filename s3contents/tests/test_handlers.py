@@ -0,0 +1,64 @@
+import boto3
+import pytest
+from tornado import web
+from tornado.testing import AsyncHTTPTestCase
+
+from s3contents import S3ContentsManager
+from s3contents.handlers import PresignedFilesHandler
+
+moto = pytest.importorskip("moto")
+# moto >= 5 has a single decorator for every service
+mock_s3 = getattr(moto, "mock_aws", None) or moto.mock_s3
+
+
+class FilesHandler(PresignedFilesHandler):
+
+    def get_current_user(self):
+        return "user"
+
+    def check_xsrf_cookie(self):
+        pass
+
+
+class PresignedFilesHandlerTest(AsyncHTTPTestCase):
+    thread_pool_size = 0
+
+    def setUp(self):
+        self.mock = mock_s3()
+        self.mock.start()
+        s3 = boto3.client("s3", region_name="us-east-1", aws_access_key_id="testing",
+                          aws_secret_access_key="testing")
+        s3.create_bucket(Bucket="notebooks")
+        self.contents_manager = S3ContentsManager(
+            access_key_id="testing",
+            secret_access_key="testing",
+            bucket="notebooks",
+            presigned_url_threshold=10,
+            thread_pool_size=self.thread_pool_size)
+        for path, text in [("small.txt", u"small"), ("large.txt", u"large" * 10)]:
+            self.contents_manager.fs.write(path, text.encode("utf-8"))
+        super(PresignedFilesHandlerTest, self).setUp()
+
+    def tearDown(self):
+        super(PresignedFilesHandlerTest, self).tearDown()
+        self.mock.stop()
+
+    def get_app(self):
+        return web.Application([(r"/files/(.*)", FilesHandler)],
+                               contents_manager=self.contents_manager, base_url="/")
+
+    def test_large_file_redirected(self):
+        response = self.fetch("/files/large.txt", follow_redirects=False)
+        assert response.code == 302
+        location = response.headers["Location"]
+        assert "large.txt" in location
+        assert "Signature" in location
+
+    def test_small_file_proxied(self):
+        response = self.fetch("/files/small.txt", follow_redirects=False)
+        assert response.code == 200
+        assert response.body == b"small"
+
+
+class PresignedFilesHandlerThreadPoolTest(PresignedFilesHandlerTest):
+    thread_pool_size = 2
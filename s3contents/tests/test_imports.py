@@ -0,0 +1,14 @@
+import subprocess
+import sys
+
+import pytest
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason="lazy imports need Python 3.7")
+def test_s3_import_is_slim():
+    code = ("import sys, s3contents; s3contents.S3ContentsManager; "
+            "print(' '.join(sorted(sys.modules)))")
+    modules = subprocess.check_output([sys.executable, "-c", code]).decode().split()
+    assert "gcsfs" not in modules
+    assert "IPython" not in modules
+    assert not [m for m in modules if m.startswith("notebook.services.contents.tests")]
@@ -0,0 +1,76 @@
+import threading
+
+import pytest
+
+from s3contents.s3_fs import MIN_PART_SIZE, MultipartWriter
+
+
+class FakeS3(object):
+    """Records the multipart requests and the max number of parts uploaded at the same time"""
+
+    def __init__(self, fail_part=None):
+        self.fail_part = fail_part
+        self.parts = {}
+        self.completed = None
+        self.aborted = False
+        self.puts = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def create_multipart_upload(self, **kwargs):
+        return {"UploadId": "upload"}
+
+    def upload_part(self, PartNumber, Body, **kwargs):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if PartNumber == self.fail_part:
+                raise IOError("part failed")
+            self.parts[PartNumber] = Body
+            return {"ETag": '"etag-%d"' % PartNumber}
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def complete_multipart_upload(self, MultipartUpload, **kwargs):
+        self.completed = MultipartUpload["Parts"]
+        return {"ETag": '"multipart-etag"'}
+
+    def abort_multipart_upload(self, **kwargs):
+        self.aborted = True
+
+    def put_object(self, Body, **kwargs):
+        self.puts.append(Body)
+        return {"ETag": '"put-etag"'}
+
+
+def test_small_object_single_put():
+    s3 = FakeS3()
+    with MultipartWriter(s3, "bucket", "key") as writer:
+        writer.write(b"small")
+    assert s3.puts == [b"small"]
+    assert s3.completed is None
+    assert writer.size == 5
+
+
+def test_parts_in_order():
+    s3 = FakeS3()
+    data = b"x" * (MIN_PART_SIZE * 2 + 10)
+    with MultipartWriter(s3, "bucket", "key", workers=2) as writer:
+        for i in range(0, len(data), 1024 * 1024):
+            writer.write(data[i:i + 1024 * 1024])
+    assert [p["PartNumber"] for p in s3.completed] == [1, 2, 3]
+    assert b"".join(s3.parts[n] for n in (1, 2, 3)) == data
+    assert s3.max_in_flight <= 2
+    assert writer.response == {"ETag": '"multipart-etag"'}
+
+
+def test_failed_part_aborts():
+    s3 = FakeS3(fail_part=1)
+    with pytest.raises(IOError):
+        with MultipartWriter(s3, "bucket", "key", workers=1) as writer:
+            writer.write(b"x" * (MIN_PART_SIZE + 1))
+    assert s3.aborted
+    assert s3.completed is None
@@ -0,0 +1,28 @@
+from s3contents.tests.utils import MemoryFS
+
+
+DATA = bytes(bytearray(range(256))) * 40  # 10240 bytes
+
+
+def test_read_range():
+    fs = MemoryFS({"f": DATA}, read_block_size=1024, read_ahead_blocks=1)
+    assert fs.read_range("f", 100, 2000) == DATA[100:2100]
+    # Blocks 0-2 plus one block of read-ahead
+    assert fs.requests == [(0, 4096)]
+    assert fs.read_range("f", 3000, 1000) == DATA[3000:4000]
+    assert len(fs.requests) == 1
+
+
+def test_read_range_end_of_file():
+    fs = MemoryFS({"f": DATA}, read_block_size=1024, read_ahead_blocks=4)
+    assert fs.read_range("f", 10000, 1000) == DATA[10000:]
+    assert fs.requests == [(9216, 10240)]
+    assert fs.read_range("f", 20000, 10) == b""
+
+
+def test_read_range_changed_file():
+    files = {"f": DATA}
+    fs = MemoryFS(files, read_block_size=1024, metadata_cache_ttl=0)
+    fs.read_range("f", 0, 10)
+    files["f"] = b"new content"
+    assert fs.read_range("f", 0, 3) == b"new"
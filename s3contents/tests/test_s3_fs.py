@@ -0,0 +1,154 @@
+import hashlib
+import threading
+import time
+
+import boto3
+import pytest
+
+from s3contents import S3ContentsManager
+from s3contents.checkpoints import S3Checkpoints
+from s3contents.ipycompat import GenericFileCheckpoints, new_markdown_cell, new_notebook
+
+moto = pytest.importorskip("moto")
+# moto >= 5 has a single decorator for every service
+mock_s3 = getattr(moto, "mock_aws", None) or moto.mock_s3
+
+
+@pytest.fixture
+def contents_manager():
+    with mock_s3():
+        s3 = boto3.client("s3", region_name="us-east-1", aws_access_key_id="testing",
+                          aws_secret_access_key="testing")
+        s3.create_bucket(Bucket="notebooks")
+        yield S3ContentsManager(
+            access_key_id="testing",
+            secret_access_key="testing",
+            bucket="notebooks")
+
+
+def save_text(cm, path, text):
+    cm.save({"type": "file", "format": "text", "content": text}, path)
+
+
+def keys(cm):
+    listing = cm.fs.fs.s3.list_objects_v2(Bucket="notebooks")
+    return sorted(obj["Key"] for obj in listing.get("Contents", []))
+
+
+def test_delete_file(contents_manager):
+    cm = contents_manager
+    save_text(cm, "file.txt", u"content")
+    save_text(cm, "other.txt", u"content")
+    cm.delete_file("file.txt")
+    assert not cm.file_exists("file.txt")
+    assert "file.txt" not in keys(cm)
+    assert "other.txt" in keys(cm)
+
+
+def test_delete_directory(contents_manager):
+    cm = contents_manager
+    cm.save({"type": "directory"}, "dir")
+    cm.save({"type": "directory"}, "dir/sub")
+    save_text(cm, "dir/a.txt", u"a")
+    save_text(cm, "dir/sub/b.txt", u"b")
+    save_text(cm, "dir2.txt", u"not under dir")
+    cm.delete_file("dir")
+    assert not cm.dir_exists("dir")
+    assert not [key for key in keys(cm) if key.startswith("dir/")]
+    assert "dir2.txt" in keys(cm)
+
+
+def test_save_not_skipped_after_overwrite_by_another_client(contents_manager):
+    cm = contents_manager
+    save_text(cm, "file.txt", u"mine")
+    # Another client overwrites the object while its metadata is cached
+    cm.fs.fs.s3.put_object(Bucket="notebooks", Key="file.txt", Body=b"theirs")
+    save_text(cm, "file.txt", u"mine")
+    body = cm.fs.fs.s3.get_object(Bucket="notebooks", Key="file.txt")["Body"].read()
+    assert body == b"mine"
+
+
+def test_save_checks_unchanged_content_with_a_single_head(contents_manager):
+    cm = contents_manager
+    cm.fs.ensure_init()
+    s3 = cm.fs.fs.s3
+    calls = []
+
+    def counted(name, method):
+        return lambda *args, **kwargs: calls.append(name) or method(*args, **kwargs)
+    for name in ("head_object", "list_objects_v2"):
+        setattr(s3, name, counted(name, getattr(s3, name)))
+    save_text(cm, "new.txt", u"content")
+    assert calls == ["head_object"]
+    del calls[:]
+    save_text(cm, "new.txt", u"content")
+    assert calls == ["head_object"]
+
+
+def test_rename_directory_moves_bucket_checkpoints(contents_manager):
+    cm = S3ContentsManager(access_key_id="testing", secret_access_key="testing",
+                           bucket="notebooks", checkpoints_class=S3Checkpoints)
+    cm.save({"type": "directory"}, "dir")
+    cm.save({"type": "directory"}, "dir/sub")
+    save_text(cm, "dir/a.txt", u"a")
+    save_text(cm, "dir/sub/b.txt", u"b")
+    cm.create_checkpoint("dir/a.txt")
+    cm.create_checkpoint("dir/sub/b.txt")
+    cm.rename("dir", "renamed")
+    assert len(cm.list_checkpoints("renamed/a.txt")) == 1
+    assert len(cm.list_checkpoints("renamed/sub/b.txt")) == 1
+    assert not [key for key in keys(cm) if key.startswith(".checkpoints/dir/")]
+
+
+def test_checkpoints_on_local_disk_by_default(contents_manager):
+    assert isinstance(contents_manager.checkpoints, GenericFileCheckpoints)
+    assert not contents_manager.is_hidden(".checkpoints")
+
+
+def test_notebook_models_do_not_share_content(contents_manager):
+    cm = contents_manager
+    nb = new_notebook(cells=[new_markdown_cell(u"original")])
+    cm.save({"type": "notebook", "content": nb}, "nb.ipynb")
+
+    # Concurrent reads share one download, then each caller mutates its own model
+    read_if_changed = cm.fs.read_if_changed
+    started, release = threading.Event(), threading.Event()
+
+    def slow_read(path, etag=None):
+        started.set()
+        release.wait()
+        return read_if_changed(path, etag)
+
+    cm.fs.read_if_changed = slow_read
+    models = []
+    leader = threading.Thread(target=lambda: models.append(cm.get("nb.ipynb")))
+    leader.start()
+    started.wait()
+    follower = threading.Thread(target=lambda: models.append(cm.get("nb.ipynb")))
+    follower.start()
+    while not cm._notebook_reads._calls["nb.ipynb"].waiters:
+        time.sleep(0.001)
+    release.set()
+    leader.join()
+    follower.join()
+    cm.fs.read_if_changed = read_if_changed
+
+    models[0]["content"]["cells"][0]["source"] = u"changed"
+    models[0]["content"]["metadata"]["changed"] = True
+    assert models[1]["content"]["cells"][0]["source"] == u"original"
+
+    # The notebook of the cache is not the one of a model either
+    model = cm.get("nb.ipynb")
+    assert model["content"]["cells"][0]["source"] == u"original"
+    assert "changed" not in model["content"]["metadata"]
+    model["content"]["cells"].append(new_markdown_cell(u"added"))
+    assert len(cm.get("nb.ipynb")["content"]["cells"]) == 1
+
+
+def test_trust_and_validation_keyed_by_sha256(contents_manager):
+    cm = contents_manager
+    cm.save({"type": "notebook", "content": new_notebook()}, "nb.ipynb")
+    data = cm.fs.read_bytes("nb.ipynb")
+    assert cm.trust_cache.get(hashlib.sha256(data).hexdigest()) is True
+    assert cm.validation_cache.get(hashlib.sha256(data).hexdigest()) is not None
+    assert cm.trust_cache.get(hashlib.md5(data).hexdigest()) is None
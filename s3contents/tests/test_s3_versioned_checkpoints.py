@@ -0,0 +1,78 @@
+import boto3
+import pytest
+
+from s3contents import S3ContentsManager
+from s3contents.checkpoints import S3VersionedCheckpoints
+
+moto = pytest.importorskip("moto")
+# moto >= 5 has a single decorator for every service
+mock_s3 = getattr(moto, "mock_aws", None) or moto.mock_s3
+
+
+@pytest.fixture
+def contents_manager():
+    with mock_s3():
+        s3 = boto3.client("s3", region_name="us-east-1", aws_access_key_id="testing",
+                          aws_secret_access_key="testing")
+        s3.create_bucket(Bucket="versioned-notebooks")
+        s3.put_bucket_versioning(Bucket="versioned-notebooks",
+                                 VersioningConfiguration={"Status": "Enabled"})
+        yield S3ContentsManager(
+            access_key_id="testing",
+            secret_access_key="testing",
+            bucket="versioned-notebooks",
+            checkpoints_class=S3VersionedCheckpoints)
+
+
+def save_text(cm, path, text):
+    cm.save({"type": "file", "format": "text", "content": text}, path)
+
+
+def test_create_and_restore_checkpoint(contents_manager):
+    cm = contents_manager
+    save_text(cm, "file.txt", u"first")
+    checkpoint = cm.create_checkpoint("file.txt")
+    save_text(cm, "file.txt", u"second")
+
+    checkpoints = cm.list_checkpoints("file.txt")
+    assert [c["id"] for c in checkpoints] == [checkpoint["id"]]
+
+    cm.restore_checkpoint(checkpoint["id"], "file.txt")
+    assert cm.get("file.txt")["content"] == u"first"
+
+
+def test_delete_removes_old_versions(contents_manager):
+    cm = contents_manager
+    save_text(cm, "file.txt", u"first")
+    cm.create_checkpoint("file.txt")
+    cm.delete("file.txt")
+    assert cm.list_checkpoints("file.txt") == []
+
+
+def test_current_version_is_not_listed(contents_manager):
+    cm = contents_manager
+    save_text(cm, "file.txt", u"first")
+    cm.create_checkpoint("file.txt")
+    assert cm.list_checkpoints("file.txt") == []
+
+
+def test_checkpoint_of_unversioned_object_keeps_its_metadata():
+    with mock_s3():
+        s3 = boto3.client("s3", region_name="us-east-1", aws_access_key_id="testing",
+                          aws_secret_access_key="testing")
+        s3.create_bucket(Bucket="versioned-notebooks")
+        # Written before versioning was enabled: its version is "null"
+        s3.put_object(Bucket="versioned-notebooks", Key="file.txt", Body=b"content",
+                      ContentType="text/plain", CacheControl="no-cache", ContentLanguage="en",
+                      Metadata={"owner": "someone"})
+        s3.put_bucket_versioning(Bucket="versioned-notebooks",
+                                 VersioningConfiguration={"Status": "Enabled"})
+        cm = S3ContentsManager(access_key_id="testing", secret_access_key="testing",
+                               bucket="versioned-notebooks", checkpoints_class=S3VersionedCheckpoints)
+        checkpoint = cm.create_checkpoint("file.txt")
+        assert checkpoint["id"] != "null"
+        head = s3.head_object(Bucket="versioned-notebooks", Key="file.txt")
+        assert head["Metadata"] == {"owner": "someone"}
+        assert head["ContentType"] == "text/plain"
+        assert head["CacheControl"] == "no-cache"
+        assert head["ContentLanguage"] == "en"
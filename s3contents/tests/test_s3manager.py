@@ -1,4 +1,4 @@
-from s3contents.ipycompat import TestContentsManager
+from s3contents.tests.utils import TestContentsManager
 
 from s3contents import S3ContentsManager
 
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+
+from s3contents.serializers import SERIALIZERS, JSONSerializer, OrjsonSerializer, get_serializer, orjson, ujson
+
+NB = {"cells": [{"cell_type": "markdown", "metadata": {}, "source": u"Résumé ✓"}],
+      "metadata": {}, "nbformat": 4, "nbformat_minor": 2}
+
+
+def test_json_serializer_bytes():
+    data = JSONSerializer().dumps(NB)
+    assert isinstance(data, bytes)
+    assert json.loads(data.decode("utf-8")) == NB
+
+
+@pytest.mark.skipif(orjson is None, reason="orjson is not installed")
+def test_orjson_same_bytes():
+    assert OrjsonSerializer().dumps(NB) == JSONSerializer().dumps(NB)
+
+
+@pytest.mark.skipif(orjson is None, reason="orjson is not installed")
+def test_orjson_known_differences():
+    json_serializer, orjson_serializer = JSONSerializer(), OrjsonSerializer()
+    assert json_serializer.dumps([1e-05, 1e+20]) == b"[1e-05,1e+20]"
+    assert orjson_serializer.dumps([1e-05, 1e+20]) == b"[0.00001,1e20]"
+    assert json_serializer.dumps([float("nan"), float("inf")]) == b"[NaN,Infinity]"
+    assert orjson_serializer.dumps([float("nan"), float("inf")]) == b"[null,null]"
+
+
+def test_loads_bytes():
+    data = JSONSerializer().dumps(NB)
+    for cls in SERIALIZERS.values():
+        try:
+            serializer = cls()
+        except ImportError:
+            continue
+        assert serializer.loads(data) == NB
+
+
+def test_get_serializer():
+    assert get_serializer("json").name == "json"
+    assert get_serializer().name == ("orjson" if orjson is not None else "ujson" if ujson is not None else "json")
+    with pytest.raises(ValueError):
+        get_serializer("pickle")
@@ -0,0 +1,21 @@
+from concurrent.futures import Future
+
+import pytest
+
+from s3contents import genericmanager
+from s3contents.genericmanager import GenericContentsManager
+
+
+def test_offloaded_calls_return_futures():
+    cm = GenericContentsManager(thread_pool_size=1)
+    cm.new = genericmanager.offload(lambda self: "model").__get__(cm)
+    future = cm.new()
+    assert isinstance(future, Future)
+    assert future.result() == "model"
+
+
+def test_thread_pool_needs_a_server_waiting_for_futures(monkeypatch):
+    monkeypatch.setattr(genericmanager, "CONTENTS_FUTURES", False)
+    with pytest.raises(ValueError):
+        GenericContentsManager(thread_pool_size=1)
+    assert GenericContentsManager()._executor is None
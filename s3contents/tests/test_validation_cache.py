@@ -0,0 +1,77 @@
+from concurrent.futures import ProcessPoolExecutor
+
+from s3contents.genericmanager import GenericContentsManager, load_notebook
+from s3contents.ipycompat import new_notebook, writes
+
+
+def counting(calls, result=None):
+    def func(*args, **kwargs):
+        calls.append(args)
+        return result
+    return func
+
+
+def test_validation_remembered_by_digest():
+    cm = GenericContentsManager()
+    calls = []
+
+    def validate(model):
+        calls.append(model)
+        model["message"] = "Notebook validation failed"
+    cm.validate_notebook_model = validate
+
+    for _ in range(3):
+        model = cm._validate_notebook_model({"content": new_notebook()}, "digest")
+        assert model["message"] == "Notebook validation failed"
+    cm._validate_notebook_model({"content": new_notebook()}, "other digest")
+    assert len(calls) == 2
+
+
+def test_trust_remembered_by_digest():
+    cm = GenericContentsManager()
+    checks, marks = [], []
+    cm.notary.check_signature = counting(checks, True)
+    cm.notary.mark_cells = counting(marks)
+
+    cm._mark_trusted_cells(new_notebook(), "a.ipynb", "digest")
+    cm._mark_trusted_cells(new_notebook(), "b.ipynb", "digest")
+    assert len(checks) == 1
+    assert [args[1] for args in marks] == [True, True]
+
+
+def test_signed_content_not_signed_again():
+    cm = GenericContentsManager()
+    signs = []
+    cm.notary.check_cells = counting([], True)
+    cm.notary.sign = counting(signs)
+
+    cm._check_and_sign(new_notebook(), "a.ipynb", "digest")
+    cm._check_and_sign(new_notebook(), "a.ipynb", "digest")
+    assert len(signs) == 1
+
+    cm.trust_cache.clear()
+    cm._check_and_sign(new_notebook(), "a.ipynb", "digest")
+    assert len(signs) == 2
+
+
+def test_load_notebook_in_process_pool():
+    data = writes(new_notebook(), 4).encode("utf-8")
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        nb, message = pool.submit(load_notebook, data, "json", True).result()
+    assert nb == new_notebook()
+    assert message is None
+
+    invalid = data.replace(b'"cells": []', b'"cells": [], "unknown": 1')
+    nb, message = load_notebook(invalid, "json")
+    assert message.startswith("Notebook validation failed")
+    assert load_notebook(invalid, "json", validate=False)[1] is None
+
+
+def test_process_pool_only_with_thread_pool():
+    data = b" " * 10
+    assert not GenericContentsManager(process_pool_size=1, process_pool_threshold=1)._use_process_pool(data)
+    cm = GenericContentsManager(process_pool_size=1, process_pool_threshold=1, thread_pool_size=1)
+    assert cm._use_process_pool(data)
+    data = writes(new_notebook(), 4).encode("utf-8")
+    nb, message = cm._get_process_pool().submit(load_notebook, data, "json", True).result()
+    assert nb == new_notebook()
@@ -1,6 +1,20 @@
+import hashlib
 import os
+import threading
+
 import pytest
 
+from s3contents.genericfs import FileInfo, GenericFS, NoSuchFile, missing
+from s3contents.ipycompat import IPY3
+
+# The notebook test suites pull in test-only dependencies: import them from here, not from ipycompat
+if IPY3:
+    from IPython.html.services.contents.tests.test_manager import (TestContentsManager)
+    from IPython.html.services.contents.tests.test_contents_api import (APITest)
+else:
+    from notebook.services.contents.tests.test_manager import (TestContentsManager)
+    from notebook.services.contents.tests.test_contents_api import (APITest)
+
 
 def mark_class(marker):
     '''Workaround for https://github.com/pytest-dev/pytest/issues/568'''
@@ -26,3 +40,56 @@ def mark_class(marker):
 
 RUN_GCSFS_TESTS = "RUN_GCSFS_TESTS" not in os.environ
 GCS_TEST = mark_class(pytest.mark.skipif(RUN_GCSFS_TESTS, reason="Only run GCS if tell to"))
+
+
+class MemoryFS(GenericFS):
+    """File system over a dict of bytes, counting the downloads, uploads and ranged requests"""
+
+    def __init__(self, files=None, bucket="bucket", **kwargs):
+        super(MemoryFS, self).__init__(**kwargs)
+        self.files = files if files is not None else {}
+        self.bucket = bucket
+        self.reads = []
+        self.writes = []
+        self.requests = []
+        self.uploading = threading.Event()
+        self.uploading.set()
+
+    def cache_key(self, path):
+        return path.strip("/")
+
+    def etag(self, path):
+        return '"{}"'.format(hashlib.md5(self.files[path]).hexdigest())
+
+    def _stat(self, path):
+        if path not in self.files:
+            return missing(path)
+        return FileInfo(path=path, type="file", size=len(self.files[path]), mtime=None,
+                        etag=self.etag(path))
+
+    def ls(self, path="", detail=False):
+        paths = sorted(p for p in self.files if p.rpartition("/")[0] == path)
+        return [self.stat(p) for p in paths] if detail else paths
+
+    def read_if_changed(self, path, etag=None):
+        if path not in self.files:
+            raise NoSuchFile(path)
+        if etag == self.etag(path):
+            return None, etag
+        self.reads.append(path)
+        return self.files[path], self.etag(path)
+
+    def _read_range(self, path, start, end):
+        self.requests.append((start, end))
+        return self.files[path][start:end]
+
+    def write(self, path, content):
+        self.uploading.wait()
+        self.writes.append(path)
+        self.files[path] = content if isinstance(content, bytes) else b"".join(content)
+        self.invalidate(path)
+        return self.stat(path)
+
+    def rm(self, path):
+        del self.files[path]
+        self.invalidate(path)
@@ -1,5 +1,4 @@
-from distutils.core import setup
-from setuptools import find_packages
+from setuptools import find_packages, setup
 
 import versioneer
 
@@ -18,5 +17,13 @@ setup(
     license="Apache 2.0",
     packages=find_packages(),
     install_requires=requirements,
+    extras_require={
+        # AsyncS3ContentsManager and AsyncGCSContentsManager, Python >= 3.6
+        "async": [
+            "jupyter_server>=1.0,<3",
+            "aiobotocore>=1.0,<4",
+            "gcsfs>=2021.4.0",
+        ],
+    },
     zip_safe=False,
 )